@@ -26,6 +26,12 @@ setup(name='sqla_yaml_fixtures',
         'Intended Audience :: Developers',
         ],
       packages=['sqla_yaml_fixtures'],
+      py_modules=['sqla_yaml_fixtures_client'],
+      entry_points={
+          'console_scripts': [
+              'sqla_yaml_fixtures_client = sqla_yaml_fixtures_client:main',
+          ],
+      },
       install_requires=[
           'SQLAlchemy',
           'PyYAML'
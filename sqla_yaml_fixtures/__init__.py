@@ -1,69 +1,551 @@
-from functools import lru_cache
+import json
+import asyncio
+import time
+import itertools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext, ExitStack
 
-import yaml
 import sqlalchemy
+from sqlalchemy.orm import Session
 from sqlalchemy.orm.relationships import RelationshipProperty
+from sqlalchemy.orm.state import InstanceState
+
+from .stats import StatementStats, StatementBudgetExceeded
+from .stats import MemoryProfile, NullProfile
+from .stats import Progress, NullProgress, ProgressEvent
+from .files import FileRef, FixtureLoader, file_constructor
+from .files import python_type
+from .coerce import column_converters, coerce_block, format_errors
+from .partition import referenced_keys, shared_engine, partitionable, shards
+from .include import IncludeCache
+from .schema import from_registry, RelationshipIndex, get_relationship_index
+from .schema import fixture_target
+from .fixtures import Fixtures, parse, iter_entries, is_lookup
+from .validate import validate, validate_core, FixtureError
+from .reset import reset_data
+
+
+__all__ = [
+    'Store', 'load', 'load_core', 'load_many', 'TargetResult',
+    'parse', 'Fixtures', 'IncludeCache',
+    'validate', 'validate_core', 'FixtureError',
+    'from_registry', 'RelationshipIndex', 'get_relationship_index',
+    'StatementStats', 'StatementBudgetExceeded',
+    'MemoryProfile', 'NullProfile', 'Progress', 'NullProgress',
+    'ProgressEvent',
+    'FileRef', 'FixtureLoader', 'file_constructor',
+    'reset_data',
+]
 
 
 __version__ = (1, 2, 0)
 
 
+def _instance_state(obj):
+    '''SQLAlchemy InstanceState of obj, None if not a mapped instance'''
+    state = sqlalchemy.inspect(obj, raiseerr=False)
+    return state if isinstance(state, InstanceState) else None
+
+
 class Store:
     '''Simple key-value store
 
     Key might be a dot-separated where each name after a dot
     represents and attribute of the value-object.
+
+    Attributes of mapped objects are taken from the in-memory object
+    graph when already loaded, avoiding lazy-load SELECTs.
+    `lazy_loads_avoided` counts lazy-loads replaced by batch queries.
+    `stats` is set to StatementStats by a load with statement counting.
+    `memory` is set to MemoryProfile by a load with memory profiling.
+
+    Keys can be saved to a file (`save()`) and used by a later load
+    (`from_file()`), only (mapper/table name, primary key) is saved.
+    Objects of saved keys are fetched from the DB when referenced.
     '''
 
     def __init__(self):
         self._store = {}
+        self.lazy_loads_avoided = 0
+        self.stats = None  # StatementStats
+        self.memory = None  # MemoryProfile
+        # key -> (mapper/table name, primary key) of objects not fetched
+        self._index = {}
+        self._tables = {}  # key -> Table, of core rows
+        self._wanted = set()  # keys of _index referenced by fixtures
+        self._fetch = None  # callable(name, pks) -> {pk: obj}
+
+    @classmethod
+    def from_file(cls, path):
+        '''create Store with keys saved by `save()`'''
+        store = cls()
+        with open(path) as fp:
+            index = json.load(fp)
+        store._index = {key: (name, tuple(pk))
+                        for key, (name, pk) in index.items()}
+        return store
+
+    def save(self, path):
+        '''save keys as JSON: key -> [mapper or table name, primary key]
+
+        Primary key values must be JSON serializable.
+        '''
+        index = {key: [name, list(pk)]
+                 for key, (name, pk) in self._index.items()}
+        for key, value in self._store.items():
+            state = _instance_state(value)
+            if state is not None:
+                if state.identity is not None:
+                    index[key] = [state.mapper.class_.__name__,
+                                  list(state.identity)]
+            elif key in self._tables:
+                table = self._tables[key]
+                index[key] = [table.name, [getattr(value, col.key)
+                                           for col in table.primary_key]]
+        with open(path, 'w') as fp:
+            json.dump(index, fp, separators=(',', ':'))
+
+    def _collect(self, references):
+        '''find saved keys in values of reference positions
+
+        Only used to fetch objects of many keys in a single query,
+        a saved key not collected is fetched when used.
+        '''
+        if not self._index:
+            return
+        for value in references:
+            keys = value if isinstance(value, list) else [value]
+            for key in keys:
+                if isinstance(key, str):
+                    key = key.split('.')[0]
+                    if key in self._index:
+                        self._wanted.add(key)
+
+    def _index_groups(self, keys):
+        '''@return {name: {primary key: [keys]}} of saved keys'''
+        groups = {}
+        for key in keys:
+            if key in self._index:
+                name, pk = self._index[key]
+                groups.setdefault(name, {}).setdefault(pk, []).append(key)
+        return groups
+
+    def _put_fetched(self, name, pk_keys, found, table=None):
+        '''save objects fetched from DB
+
+        :param pk_keys: {primary key: [keys]}
+        :param found: {primary key: obj}
+        :param table: Table of core rows (used by `save()`)
+        '''
+        for pk, keys in pk_keys.items():
+            if pk not in found:
+                msg = 'Saved key `{}` not found: {} {}'
+                raise Exception(msg.format(keys[0], name, pk))
+            for key in keys:
+                del self._index[key]
+                self._store[key] = found[pk]
+                if table is not None:
+                    self._tables[key] = table
+
+    def _value(self, key):
+        '''value of a (non-dotted) key, fetching saved keys from DB'''
+        try:
+            return self._store[key]
+        except KeyError:
+            if key not in self._index or self._fetch is None:
+                raise
+        # fetch all referenced keys of same mapper in a single query
+        name = self._index[key][0]
+        keys = [k for k in self._wanted | {key}
+                if k in self._index and self._index[k][0] == name]
+        pk_keys = self._index_groups(keys)[name]
+        self._put_fetched(name, pk_keys, self._fetch(name, list(pk_keys)))
+        return self._store[key]
+
+    @staticmethod
+    def _get_attr(obj, name):
+        state = _instance_state(obj)
+        if state is not None and name in state.dict:
+            return state.dict[name]
+        return getattr(obj, name)
 
     def get(self, key):
         parts = key.split('.')
-        ref_obj = self._store[parts.pop(0)]
+        ref_obj = self._value(parts.pop(0))
         while parts:
-            ref_obj = getattr(ref_obj, parts.pop(0))
+            ref_obj = self._get_attr(ref_obj, parts.pop(0))
         return ref_obj
 
-    def put(self, key, value):
+    def get_many(self, keys):
+        '''get list of values, same as `get()` for every key
+
+        Dotted paths are resolved one level at a time, attributes that
+        need to be loaded from the DB are fetched in a single query
+        per (mapper, attribute).
+        '''
+        paths = [key.split('.') for key in keys]
+        values = [self._value(path[0]) for path in paths]
+        depth = 1
+        while True:
+            pending = [idx for idx, path in enumerate(paths)
+                       if len(path) > depth]
+            if not pending:
+                return values
+            self._batch_load([(values[idx], paths[idx][depth])
+                              for idx in pending])
+            for idx in pending:
+                values[idx] = self._get_attr(values[idx], paths[idx][depth])
+            depth += 1
+
+    def _batch_load(self, attrs):
+        '''load unloaded attributes of persistent objects
+
+        :param attrs: list of (obj, attribute name)
+        '''
+        # (mapper, attribute name) -> {identity: obj}
+        groups = {}
+        for obj, name in attrs:
+            state = _instance_state(obj)
+            if state is None or state.key is None or name in state.dict:
+                continue
+            mapper = state.mapper
+            if len(mapper.primary_key) != 1:
+                continue
+            group = groups.setdefault((mapper, name), {})
+            group[state.identity[0]] = obj
+
+        for (mapper, name), objs in groups.items():
+            if len(objs) < 2:
+                continue  # regular lazy-load
+            prop = mapper.attrs.get(name)
+            if prop is None:
+                continue
+            session = sqlalchemy.orm.object_session(next(iter(objs.values())))
+            query = session.query(mapper).filter(
+                mapper.primary_key[0].in_(list(objs)))
+            if isinstance(prop, RelationshipProperty):
+                if prop.lazy not in ('select', True):
+                    continue  # i.e. dynamic
+                query = query.options(
+                    sqlalchemy.orm.selectinload(prop.class_attribute))
+            query.all()
+            self.lazy_loads_avoided += len(objs) - 1
+
+    def put(self, key, value, table=None):
+        '''
+        :param table: Table of a core row (used by `save()`)
+        '''
         assert key not in self._store, "Duplicate key:{}".format(key)
+        assert key not in self._index, "Duplicate key:{}".format(key)
         self._store[key] = value
+        if table is not None:
+            self._tables[key] = table
 
 
 #############################
 ### ORM
 
-def from_registry(Base, model_name):
-    """Compatibility for SQLAlchemy 1.4 changes
+def _pairs_values(pairs, obj):
+    '''values for a row from obj columns
 
-    https://github.com/sqlalchemy/sqlalchemy/commit/450f5c0d6519a439f4025c3892fe4cf3ee2d892c
-    """
-    if hasattr(Base, '_decl_class_registry'): # SQLAlchemy < 1.4
-        return Base._decl_class_registry[model_name]
-    else:
-        return Base.registry._class_registry[model_name]
+    :var pairs: list of (obj column, row column)
+    @return dict row column key -> value
+    '''
+    mapper = sqlalchemy.inspect(obj).mapper
+    return {dst.key: getattr(obj, mapper.get_property_by_column(src).key)
+            for src, dst in pairs}
 
 
+class _Links:
+    '''many-to-many rows written directly into association tables
 
-@lru_cache()
-def _get_rel_col_for(src_model, target_model_name):
-    '''find the column in src_model that is a relationship to target_model
-    @return column name
+    Rows are built only after objects are flushed,
+    when their primary keys are known.
     '''
-    # FIXME deal with self-referential m2m
-    for name, col in src_model._sa_class_manager.items():
+
+    def __init__(self):
+        # table -> list of (parent_pairs, parent, target_pairs, targets)
+        # where pairs are (obj column, association table column)
+        self._pending = {}
+
+    def add(self, table, parent_pairs, parent, target_pairs, targets):
+        self._pending.setdefault(table, []).append(
+            (parent_pairs, parent, target_pairs, targets))
+
+    def insert(self, session):
+        '''flush session and insert rows, one executemany per table'''
+        session.flush()
+        for table, entries in self._pending.items():
+            rows = []
+            for parent_pairs, parent, target_pairs, targets in entries:
+                parent_values = _pairs_values(parent_pairs, parent)
+                for target in targets:
+                    row = _pairs_values(target_pairs, target)
+                    row.update(parent_values)
+                    rows.append(row)
+            session.execute(table.insert(), rows)
+        self._pending.clear()
+
+
+def _orm_references(ModelBase, sources):
+    '''yield values in reference positions: relationship fields and
+    `__init__` params that are not attributes
+
+    Values are a key (str), a list of keys or a lookup.
+    Nested objects are walked, column values (i.e. JSON) are not.
+    '''
+    stack = []
+    for _, model_name, defaults, instances in iter_entries(sources):
         try:
-            target = col.property.mapper.class_
-        except AttributeError:
+            model = from_registry(ModelBase, model_name.split(':')[0])
+        except KeyError:
+            continue  # reported when entry is loaded
+        rows = instances if defaults is None else [defaults] + instances
+        stack.extend((model, fields) for fields in reversed(rows))
+    while stack:
+        model, fields = stack.pop()
+        if not isinstance(fields, dict):
             continue
-        if target.__name__ == target_model_name:
-            return name
-    msg = 'Mapper `{}` has no field with relationship to type `{}`'
-    raise Exception(msg.format(src_model.__name__, target_model_name))
+        for name, value in fields.items():
+            try:
+                prop = getattr(model, name).property
+            except AttributeError:
+                # __init__ param that is not a column
+                if is_lookup(value):
+                    yield value
+                elif isinstance(value, dict) and 'ref' in value:
+                    yield value['ref']
+                continue
+            if not isinstance(prop, RelationshipProperty):
+                continue
+            rel_model = prop.mapper.class_
+            if is_lookup(value) or isinstance(value, str):
+                yield value
+            elif isinstance(value, dict):
+                stack.append((rel_model, value))
+            elif isinstance(value, list) and value:
+                if isinstance(value[0], str):
+                    yield value
+                else:
+                    stack.extend((rel_model, item) for item in value)
+
+
+def _core_references(tables, sources):
+    '''yield values of foreign key columns: a key (str) or a lookup'''
+    for _, table_name, defaults, instances in iter_entries(sources):
+        table = tables.get(table_name)
+        if table is None:
+            continue  # reported when entry is loaded
+        rows = instances if defaults is None else [defaults] + instances
+        for fields in rows:
+            if not isinstance(fields, dict):
+                continue
+            for name, value in fields.items():
+                col = table.c.get(name)
+                if col is not None and col.foreign_keys:
+                    yield value
+
+
+# max number of values of a single `IN (...)`, bound parameters
+# per statement are limited by some drivers
+MAX_IN_VALUES = 500
 
 
-def _create_obj(ModelBase, session, store,
-                model_name, creator, key, values):
+def _chunks(values):
+    '''split values in lists of at most MAX_IN_VALUES'''
+    values = list(values)
+    for start in range(0, len(values), MAX_IN_VALUES):
+        yield values[start:start + MAX_IN_VALUES]
+
+
+class _Lookups:
+    '''references to rows already in the DB, by natural key
+
+    All lookups in the fixtures are collected before loading and
+    resolved with one query per (mapper/table, columns) and chunk of
+    MAX_IN_VALUES values.
+    Only values in reference positions (relationships, FK columns) are
+    lookups, a JSON column value might have the same structure.
+    Results are cached for the whole load.
+    '''
+
+    def __init__(self):
+        # (name, columns) -> set of values (tuple)
+        self._pending = {}
+        # (name, columns, values) -> obj or row
+        self._found = {}
+
+    @staticmethod
+    def _key(lookup):
+        by = lookup['by']
+        columns = tuple(sorted(by))
+        return lookup['lookup'], columns, tuple(by[col] for col in columns)
+
+    def collect(self, references):
+        '''find lookups in values of reference positions'''
+        for value in references:
+            if is_lookup(value):
+                name, columns, values = self._key(value)
+                self._pending.setdefault((name, columns), set()).add(values)
+
+    def __bool__(self):
+        return bool(self._pending)
+
+    @staticmethod
+    def _where(cols, values):
+        if len(cols) == 1:
+            return cols[0].in_([vals[0] for vals in values])
+        return sqlalchemy.tuple_(*cols).in_(list(values))
+
+    def resolve(self, ModelBase, session):
+        '''query objects from ORM, one query per (mapper, columns)'''
+        for (name, columns), values in self._pending.items():
+            model = from_registry(ModelBase, name)
+            cols = [getattr(model, col) for col in columns]
+            for chunk in _chunks(values):
+                query = session.query(model).filter(self._where(cols, chunk))
+                for obj in query:
+                    found = tuple(getattr(obj, col) for col in columns)
+                    self._found[(name, columns, found)] = obj
+        self._pending.clear()
+
+    async def resolve_core(self, tables, connection):
+        '''select rows from tables, one query per (table, columns)'''
+        for (name, columns), values in self._pending.items():
+            table = tables[name]
+            cols = [table.c[col] for col in columns]
+            for chunk in _chunks(values):
+                stmt = table.select().where(self._where(cols, chunk))
+                for row in await connection.execute(stmt):
+                    found = tuple(getattr(row, col) for col in columns)
+                    self._found[(name, columns, found)] = row
+        self._pending.clear()
+
+    def get(self, lookup):
+        try:
+            return self._found[self._key(lookup)]
+        except KeyError:
+            msg = 'Lookup `{}` not found by: {}'
+            raise Exception(msg.format(lookup['lookup'], lookup['by']))
+
+
+class _Defaults:
+    '''`__defaults__` of an entry, classified once for all its rows
+
+    Defaults are layered under the values of each row, values set
+    by the row take precedence.
+
+    :var plain (dict): values used as they are (columns, init params)
+    :var values (dict): values resolved for every row (references,
+                        nested objects, lookups, files)
+    '''
+    __slots__ = ('plain', 'values')
+
+    def __init__(self, plain, values):
+        self.plain = plain
+        self.values = values
+
+    def layer(self, values):
+        '''@return (plain defaults, iterable of (name, value)) for a row'''
+        plain = {name: value for name, value in self.plain.items()
+                 if name not in values}
+        items = values.items()
+        if self.values:
+            items = itertools.chain(
+                [(name, value) for name, value in self.values.items()
+                 if name not in values], items)
+        return plain, items
+
+
+def _orm_defaults(model, defaults):
+    '''classify `__defaults__` values of a mapper entry'''
+    if defaults is None:
+        return None
+    plain, values = {}, {}
+    for name, value in defaults.items():
+        prop = getattr(getattr(model, name, None), 'property', None)
+        if (isinstance(value, (dict, FileRef))
+                or isinstance(prop, RelationshipProperty)):
+            values[name] = value
+        else:
+            plain[name] = value
+    return _Defaults(plain, values)
+
+
+class _Resolved:
+    '''values of an object, resolved before the object is created
+
+    :var scalars (dict): params passed to mapper __init__ (or creator)
+    :var children (list): _Node of nested objects without back_populates,
+                          created before the object into `scalars`
+    :var nested (list): (model-name, field_name, value, path) created
+                        after container object, reference to container
+                        is set on back_populates
+    :var many (list): (field_name, [values]) "2many" references
+    :var bulk (list): (table, parent_pairs, target_pairs, [values])
+                      "2many" references written directly into
+                      association table
+    '''
+    __slots__ = ('scalars', 'children', 'nested', 'many', 'bulk')
+
+    def __init__(self, scalars, children, nested, many, bulk):
+        self.scalars = scalars
+        self.children = children
+        self.nested = nested
+        self.many = many
+        self.bulk = bulk
+
+
+class _Node:
+    '''an object to be created, item of the work-stack of `_run()`
+
+    :var path (str): location of values, used on error messages
+                     i.e. `User.profile.address`
+    :var parent (tuple): (parent _Node, field name, list index or None)
+                         where obj is set in parent scalars
+    :var resolved (_Resolved): None until values are resolved
+    :var nested_coerced (dict): id(values of nested object) -> values
+                                converted to column types, shared by
+                                all nodes of a block
+    '''
+    __slots__ = ('model_name', 'creator', 'key', 'values', 'defaults',
+                 'coerced', 'nested_coerced', 'path', 'parent', 'resolved',
+                 'obj')
+
+    def __init__(self, model_name, creator, key, values, defaults=None,
+                 path=None, parent=None, coerced=None, nested_coerced=None):
+        self.model_name = model_name
+        self.creator = creator
+        self.key = key
+        self.values = values
+        self.defaults = defaults
+        self.coerced = coerced  # values converted to column type
+        self.nested_coerced = nested_coerced
+        self.path = path or model_name
+        self.parent = parent
+        self.resolved = None
+        self.obj = None
+
+    def nested(self, model_name, values, path, parent=None, original=None):
+        '''@return _Node of a nested object
+
+        :param original: parsed values (if `values` is a modified copy)
+        '''
+        coerced = self.nested_coerced
+        if coerced:
+            row_coerced = coerced.get(id(values if original is None
+                                         else original))
+        else:
+            row_coerced = None
+        return _Node(model_name, None, None, values, path=path,
+                     parent=parent, coerced=row_coerced,
+                     nested_coerced=coerced)
+
+
+def _create_obj(ModelBase, session, store, model_name, creator, key, values,
+                links=None, lookups=None, defaults=None, coerced=None,
+                nested_coerced=None):
     '''create obj from values
 
     :var store (Store):
@@ -72,28 +554,111 @@ def _create_obj(ModelBase, session, store,
                         Takes 2 parameters (session, values)
     :var key (str): key for obj in Store
     :var values (dict): column:value
+    :var links (_Links): if given, "2many" references (association
+                         objects or secondary) are not set in the
+                         model, rows are written directly into the
+                         association table
+    :var lookups (_Lookups): resolved lookups of existing objects
+    :var defaults (_Defaults): `__defaults__` of entry
+    :var coerced (dict): values converted to column types
+    :var nested_coerced (dict): converted values of nested objects,
+                                returned by `_coerce_nested()`
+    '''
+    node = _Node(model_name, creator, key, values, defaults,
+                 coerced=coerced, nested_coerced=nested_coerced)
+    _run(ModelBase, session, store, [node], links, lookups)
+    return node.obj
+
+
+def _run(ModelBase, session, store, stack, links, lookups):
+    '''create objects of nodes in stack, and all nested objects
+
+    Nested objects are handled with an explicit stack (no recursion),
+    so deep trees do not hit the recursion limit.
+    A node is visited twice when it has children (nested objects
+    without back_populates): first to resolve its values and push
+    children on top of it, then to create the object.
+    '''
+    while stack:
+        node = stack.pop()
+        if node.resolved is None:
+            node.resolved = _resolve_values(
+                ModelBase, session, store, node, links, lookups)
+            if node.resolved.children:
+                stack.append(node)
+                stack.extend(reversed(node.resolved.children))
+                continue
+        _construct(ModelBase, session, node)
+        _finish_obj(ModelBase, store, node, links, stack)
+
+
+def _construct(ModelBase, session, node):
+    '''create node obj from resolved values'''
+    model = from_registry(ModelBase, node.model_name)
+    creator = node.creator
+    if creator is None:
+        creator = 'from_fixture' if hasattr(model, 'from_fixture') else None
+
+    scalars = node.resolved.scalars
+    try:
+        if creator is None:
+            node.obj = model(**scalars)
+        else:
+            node.obj = getattr(model, creator)(session, scalars)
+    except StatementBudgetExceeded:
+        raise
+    except Exception as orig_exp:
+        if node.parent is None and node.path == node.model_name:
+            raise  # top level, no path to be added
+        raise Exception('Error processing {}={}\n{}'.format(
+            node.path, node.values, str(orig_exp)))
+
+
+def _resolve_values(ModelBase, session, store, node, links, lookups):
+    '''resolve references of values, nested objects are added as
+    children (without back_populates) or nested (with back_populates)
+
+    @return _Resolved
     '''
-    # get reference to SqlAlchemy Mapper
-    model = from_registry(ModelBase, model_name)
+    model = from_registry(ModelBase, node.model_name)
+    values = node.values
 
     # scalars will be passed to mapper __init__
-    scalars = {}
+    if node.defaults is None:
+        scalars = {}
+        items = values.items()
+    else:
+        scalars, items = node.defaults.layer(values)
+
+    # Nested objects without back_populates are created before
+    # container object, and set on scalars
+    children = []
 
     # Nested data will be created after container object,
     # container object reference is found by back_populates
-    # each element is a tuple (model-name, field_name, value)
+    # each element is a tuple (model-name, field_name, value, path)
     nested = []
 
     # references "2many" that are in a list
     many = []  # each element is 2-tuple (field_name, [values])
 
-    for name, value in values.items():
+    # "2many" references written directly into association table
+    # each element is (table, parent_pairs, target_pairs, [values])
+    bulk = []
+
+    for name, value in items:
+        if name == '__key__':
+            continue
         try:
             try:
                 column = getattr(getattr(model, name), 'property')
             except AttributeError:
                 # __init__ param that is not a column
-                if isinstance(value, dict):
+                if is_lookup(value):
+                    scalars[name] = lookups.get(value)
+                elif isinstance(value, FileRef):
+                    scalars[name] = value.read()
+                elif isinstance(value, dict):
                     scalars[name] = store.get(value['ref'])
                 else:
                     scalars[name] = value
@@ -101,24 +666,33 @@ def _create_obj(ModelBase, session, store,
 
             # simple value assignemnt
             if not isinstance(column, RelationshipProperty):
+                if isinstance(value, FileRef):
+                    cols = getattr(column, 'columns', None)
+                    binary = bool(cols) and python_type(cols[0].type) is bytes
+                    value = value.read(binary)
                 scalars[name] = value
                 continue
 
             # relationship
             rel_name = column.mapper.class_.__name__
-            if isinstance(value, dict):
+            path = '{}.{}'.format(node.path, name)
+            # an existing object from the DB
+            if is_lookup(value):
+                scalars[name] = lookups.get(value)
+
+            elif isinstance(value, dict):
                 # If column includes a back_populates, we assume
                 # the constructor of the nested object takes a reference
                 # to its parent.
                 if column.back_populates:
-                    nested.append([rel_name, column.back_populates,
-                                   value])
+                    nested.append((rel_name, column.back_populates,
+                                   value, path))
                 # If there is no back_populates create the nested object
                 # first
                 else:
-                    scalars[name] = _create_obj(
-                        ModelBase, session, store,
-                        rel_name, None, None, value)
+                    scalars[name] = None
+                    children.append(node.nested(
+                        rel_name, value, path, parent=(node, name, None)))
 
             # a reference (key) was passed, get obj from store
             elif isinstance(value, str):
@@ -130,192 +704,770 @@ def _create_obj(ModelBase, session, store,
                 # if list element are string they are references
                 if isinstance(value[0], str):
                     secondary = getattr(column, 'secondary', None)
+                    targets = store.get_many(value)
                     if secondary is None:
                         # assume association object and find other reference
-                        tgt_model_name = store.get(value[0]).__class__.__name__
-                        rel_model = from_registry(ModelBase, rel_name)
-                        col_name = _get_rel_col_for(rel_model, tgt_model_name)
-                        refs = [rel_model(**{col_name: store.get(v)})
-                                for v in value]
+                        tgt_mapper = sqlalchemy.inspect(targets[0]).mapper
+                        # relationship back to parent is not the reference
+                        assoc_rel = get_relationship_index(ModelBase).find_one(
+                            column.mapper, tgt_mapper,
+                            exclude=column._reverse_property,
+                            key=fixture_target(column))
+                        if links is not None:
+                            bulk.append((
+                                column.target,
+                                column.local_remote_pairs,
+                                [(r, l) for l, r in
+                                 assoc_rel.local_remote_pairs],
+                                targets))
+                            continue
+                        rel_model = column.mapper.class_
+                        refs = [rel_model(**{assoc_rel.key: target})
+                                for target in targets]
                     else:
-                        refs = [store.get(v) for v in value]
+                        refs = targets
+                        if links is not None:
+                            bulk.append((
+                                secondary,
+                                column.synchronize_pairs,
+                                column.secondary_synchronize_pairs,
+                                refs))
+                            continue
                     many.append((name, refs))
 
                 # else they are a list of nested elements
                 else:
                     if column.back_populates:
                         nested.extend(
-                            [rel_name, column.back_populates, v]
-                            for v in value)
+                            (rel_name, column.back_populates, v,
+                             '{}[{}]'.format(path, idx))
+                            for idx, v in enumerate(value))
                     # If there is no back_populates create the nested objects
                     # first
                     else:
-                        scalars[name] = [_create_obj(
-                            ModelBase, session, store,
-                            rel_name, None, None, v)
-                            for v in value]
+                        scalars[name] = [None] * len(value)
+                        children.extend(
+                            node.nested(rel_name, v,
+                                        '{}[{}]'.format(path, idx),
+                                        parent=(node, name, idx))
+                            for idx, v in enumerate(value))
 
             # nested field which object was just created
             else:
                 scalars[name] = value
 
+        except StatementBudgetExceeded:
+            raise
         except Exception as orig_exp:
             raise Exception('Error processing {}.{}={}\n{}'.format(
-                model_name, name, value, str(orig_exp)))
-
-    if creator is None:
-        creator = 'from_fixture' if hasattr(model, 'from_fixture') else None
-
-    if creator is None:
-        obj = model(**scalars)
-    else:
-        obj = getattr(model, creator)(session, scalars)
+                node.path, name, value, str(orig_exp)))
+    if node.coerced:
+        scalars.update(node.coerced)
+    return _Resolved(scalars, children, nested, many, bulk)
+
+
+def _finish_obj(ModelBase, store, node, links, stack):
+    '''set obj on parent, save obj in store, set "2many" references,
+    push nested objects (with back_populates) into stack'''
+    obj = node.obj
+    resolved = node.resolved
+    if node.parent is not None:
+        parent, name, idx = node.parent
+        if idx is None:
+            parent.resolved.scalars[name] = obj
+        else:
+            parent.resolved.scalars[name][idx] = obj
 
     # add a nested objects with reference to parent
-    for rel_name, back_populates, value in nested:
-        value[back_populates] = obj
-        _create_obj(ModelBase, session, store,
-                    rel_name, None, None, value)
+    # (parsed data is not modified, it might be loaded again)
+    stack.extend(reversed([
+        node.nested(rel_name, dict(value, **{back_populates: obj}), path,
+                    original=value)
+        for rel_name, back_populates, value, path in resolved.nested]))
 
     # save obj in store
-    if key:
-        store.put(key, obj)
+    if node.key:
+        store.put(node.key, obj)
 
     # 2many references
-    for field_name, value_list in many:
+    for field_name, value_list in resolved.many:
         setattr(obj, field_name, value_list)
+    for table, parent_pairs, target_pairs, targets in resolved.bulk:
+        links.add(table, parent_pairs, obj, target_pairs, targets)
 
-    return obj
+
+def _coerce(name, converters, rows, defaults, offset):
+    '''convert values of an entry (and its defaults) to column types
+
+    @return list of converted values (dict or None) for each row
+    '''
+    if not converters:
+        return [None] * len(rows)
+    if defaults is not None and defaults.plain:
+        converted, errors = coerce_block(converters, [defaults.plain])
+        if errors:
+            raise ValueError(format_errors(name + '.__defaults__', errors))
+        if converted[0]:
+            defaults.plain.update(converted[0])
+    converted, errors = coerce_block(converters, rows)
+    if errors:
+        raise ValueError(format_errors(name, errors, offset))
+    return converted
+
+
+def _model_converters(model):
+    '''@return column converters of a mapped class'''
+    return column_converters((attr.key, attr.columns[0])
+                             for attr in model.__mapper__.column_attrs)
+
+
+def _coerce_nested(name, model, rows, offset, converters):
+    '''convert values of nested objects (relationship values that are
+    mappings) to column types, one block per mapper
+
+    :param converters: {model: column converters}, cache updated with
+                       mappers of nested objects
+    @return {id(values of nested object): converted values}
+    '''
+    groups = {}  # model -> (paths, values)
+    stack = [(model, '{}[{}]'.format(name, idx + offset), fields)
+             for idx, fields in enumerate(rows)]
+    while stack:
+        parent, path, fields = stack.pop()
+        relationships = parent.__mapper__.relationships
+        if not relationships or not isinstance(fields, dict):
+            continue
+        for field, value in fields.items():
+            prop = relationships.get(field)
+            if prop is None:
+                continue
+            field_path = '{}.{}'.format(path, field)
+            if isinstance(value, dict) and not is_lookup(value):
+                items = [(field_path, value)]
+            elif isinstance(value, list):
+                items = [('{}[{}]'.format(field_path, idx), item)
+                         for idx, item in enumerate(value)
+                         if isinstance(item, dict)]
+            else:
+                continue
+            rel_model = prop.mapper.class_
+            paths, values = groups.setdefault(rel_model, ([], []))
+            for item_path, item in items:
+                paths.append(item_path)
+                values.append(item)
+                stack.append((rel_model, item_path, item))
+
+    result = {}
+    for rel_model, (paths, values) in groups.items():
+        if rel_model not in converters:
+            converters[rel_model] = _model_converters(rel_model)
+        if not converters[rel_model]:
+            continue
+        converted, errors = coerce_block(converters[rel_model], values)
+        if errors:
+            raise ValueError('\n'.join(
+                'Invalid value for {}.{}: {}'.format(paths[idx], key, msg)
+                for idx, key, msg in errors))
+        for value, row_converted in zip(values, converted):
+            if row_converted:
+                result[id(value)] = row_converted
+    return result
+
+
+def _statement_stats(store, targets, stats, max_statements, names=None):
+    '''context manager that counts statements executed on targets
+
+    Statements are counted only if `stats` or `max_statements` are set.
+    '''
+    if not stats and max_statements is None:
+        return nullcontext()
+    store.stats = StatementStats(max_statements, names)
+    return _listen_all(store.stats.listen, targets)
 
 
-def load(ModelBase, session, fixture_text, loader=None):
+def _parse(fixture_text, loader, profile):
+    '''@return sources of fixtures, the `parse` phase is profiled only if
+    fixtures were not parsed already (i.e. by the caller, in its phase)'''
+    if isinstance(fixture_text, Fixtures):
+        return fixture_text.sources
+    with profile.phase('parse'):
+        return parse(fixture_text, loader).sources
+
+
+@contextmanager
+def _listen_all(listen, targets, *args):
+    '''enter `listen(target, *args)` of every target'''
+    with ExitStack() as stack:
+        for target in targets:
+            stack.enter_context(listen(target, *args))
+        yield
+
+
+def _session_binds(ModelBase, session):
+    '''@return list of distinct binds (Engine or Connection) used by
+    session for mappers of ModelBase
+
+    A session might have no default bind (`Session(binds={...})`).
+    '''
+    binds = []
+    for mapper in ModelBase.registry.mappers:
+        try:
+            bind = session.get_bind(mapper=mapper)
+        except sqlalchemy.exc.UnboundExecutionError:
+            continue
+        if not any(bind is other for other in binds):
+            binds.append(bind)
+    return binds
+
+
+def _progress(progress):
+    '''@return Progress, or NullProgress if not reporting'''
+    if isinstance(progress, Progress):
+        return progress
+    return Progress(progress) if progress else NullProgress()
+
+
+def _memory_profile(memprofile):
+    '''@return MemoryProfile, or NullProfile if not profiling'''
+    if isinstance(memprofile, MemoryProfile):
+        return memprofile
+    return MemoryProfile() if memprofile else NullProfile()
+
+
+def load(ModelBase, session, fixture_text, loader=None, bulk_many=False,
+         stats=False, max_statements=None, memprofile=False, progress=None,
+         store=None, partition=None):
+    '''load fixtures using SQLAlchemy ORM
+
+    :param fixture_text: YAML string, or a sequence of
+        (source name, YAML string). All sources are loaded in order
+        into the same Store. Or Fixtures returned by `parse()`.
+
+    :param bulk_many: if True, "2many" references (to association
+        objects or through a `secondary` table) are written directly
+        into the association table (in one executemany per table)
+        after all objects are flushed, association model instances
+        are NOT created and relationship collections are NOT set.
+    :param stats: if True, count SQL statements executed by the load,
+        counts are available on returned `store.stats`.
+    :param max_statements: raise StatementBudgetExceeded when more SQL
+        statements are executed (implies `stats`).
+    :param memprofile: if True (or a MemoryProfile instance), measure
+        memory used by each phase and mapper, available on `store.memory`.
+    :param progress: callable taking a ProgressEvent (or a Progress
+        instance), called periodically while rows are processed.
+    :param store: Store used (and returned) by the load, i.e. with keys
+        from a previous load (`Store.from_file()`).
+    :param partition: number of workers. Large blocks whose keys are
+        not referenced and with only column fields are split into
+        shards, each created by a thread on its own Session (and
+        connection) after the load session is committed.
+        Not used if the session is bound to a Connection or already in
+        a transaction. If a shard fails, the load session and shards
+        already created are committed.
+    '''
     # make sure backref attributes are created
     sqlalchemy.orm.configure_mappers()
 
-    # Data should be sequence of entry per mapper name
-    # to enforce that FKs (__key__ entries) are defined first
-    if loader is None:
-        loader = yaml.FullLoader
-    data = yaml.load(fixture_text, Loader=loader)
-    if not isinstance(data, list):
-        raise ValueError('Top level YAML should be sequence (list).')
+    profile = _memory_profile(memprofile)
+    with profile:
+        store = _load(ModelBase, session, fixture_text, loader, bulk_many,
+                      stats, max_statements, profile, _progress(progress),
+                      store, partition)
+    if memprofile:
+        store.memory = profile
+    return store
 
-    store = Store()
-    for model_entry in data:
-        if len(model_entry) != 1:
-            msg = ('Sequence item must contain only one mapper,'
-                   ' found: {}.')
-            raise ValueError(msg.format(', '.join(model_entry.keys())))
-
-        model_name, instances = model_entry.popitem()
-        # model_name can be a simple model name or <Name>:<creator>
-        if ':' in model_name:
-            model_name, creator = model_name.split(':')
-        else:
-            creator = None
 
-        if instances is None:
-            # Ignore empty entry
-            continue
-        if not isinstance(instances, list):
-            msg = '`{}` must contain a sequence(list).'
-            raise ValueError(msg.format(model_name))
-        for fields in instances:
-            key = fields.pop('__key__', None)
-            obj = _create_obj(ModelBase, session, store,
-                              model_name, creator, key, fields)
-            session.add(obj)
-    session.commit()
+def _fetch_orm(ModelBase, session):
+    '''@return function that fetches objects by primary key'''
+    def fetch(name, pks):
+        model = from_registry(ModelBase, name)
+        pk_cols = model.__mapper__.primary_key
+        return {sqlalchemy.inspect(obj).identity: obj
+                for chunk in _chunks(pks)
+                for obj in session.query(model).filter(
+                    _Lookups._where(pk_cols, chunk))}
+    return fetch
+
+
+def _load(ModelBase, session, fixture_text, loader, bulk_many,
+          stats, max_statements, profile, progress, store=None,
+          partition=None):
+    # binds are resolved only to listen to statements or partition
+    if (stats or max_statements is not None or partition
+            or not isinstance(progress, NullProgress)):
+        binds = _session_binds(ModelBase, session)
+    else:
+        binds = []
+    # shards are committed on their own sessions (single Engine), only
+    # if the load owns the transaction of session
+    if (partition and len(binds) == 1
+            and not isinstance(binds[0], sqlalchemy.engine.Connection)
+            and not session.in_transaction()):
+        engine = shared_engine(binds[0])
+    else:
+        engine = None
+
+    sources = _parse(fixture_text, loader, profile)
+
+    if store is None:
+        store = Store()
+    references = list(_orm_references(ModelBase, sources))
+    store._collect(references)
+    store._fetch = _fetch_orm(ModelBase, session)
+    links = _Links() if bulk_many else None
+    mapper_names = {
+        mapper.local_table.name: mapper.class_.__name__
+        for mapper in ModelBase.registry.mappers
+        if hasattr(mapper.local_table, 'name')}
+    # shards use connections of the same Engine, counted by its listener
+    counting = _statement_stats(store, binds,
+                                stats, max_statements, mapper_names)
+    lookups = _Lookups()
+    lookups.collect(references)
+    converters = {}  # model -> column converters
+    if engine is not None:
+        referenced = referenced_keys(sources)
+    partitioned = []  # blocks created after session is committed
+    progress.start()
+    with counting:
+        if lookups:
+            lookups.resolve(ModelBase, session)
+        with profile.phase('build'):
+            for source, model_name, defaults, instances in iter_entries(
+                    sources):
+                # model_name can be a simple model name or <Name>:<creator>
+                if ':' in model_name:
+                    model_name, creator = model_name.split(':')
+                else:
+                    creator = None
+
+                model = from_registry(ModelBase, model_name)
+                offset = 0 if defaults is None else 1
+                defaults = _orm_defaults(model, defaults)
+                if model not in converters:
+                    converters[model] = _model_converters(model)
+                coerced = _coerce(model_name, converters[model], instances,
+                                  defaults, offset)
+                nested_coerced = _coerce_nested(
+                    model_name, model, instances, offset, converters)
+                batch = (creator is None
+                         and hasattr(model, 'from_fixture_batch'))
+                if (engine is not None
+                        and not (defaults and defaults.values)
+                        and partitionable(
+                            instances, referenced, partition,
+                            set(model.__mapper__.column_attrs.keys()))):
+                    partitioned.append((source, model, model_name, creator,
+                                        batch, instances, defaults, coerced))
+                    continue
+                with profile.mapper(model_name):
+                    if batch:
+                        _create_batch(ModelBase, session, store, model,
+                                      model_name, instances, links, lookups,
+                                      progress, source, defaults, coerced,
+                                      nested_coerced)
+                        continue
+                    for fields, row_coerced in zip(instances, coerced):
+                        key = fields.get('__key__')
+                        obj = _create_obj(
+                            ModelBase, session, store, model_name, creator,
+                            key, fields, links, lookups, defaults,
+                            row_coerced, nested_coerced)
+                        session.add(obj)
+                        progress.row(model_name, source)
+        # INSERTs are executed by the flush, report its statements
+        flushing = _listen_all(progress.listen, binds, mapper_names)
+        with profile.phase('flush'), flushing:
+            if links is not None:
+                links.insert(session)
+            session.commit()
+        for block in partitioned:
+            with profile.mapper(block[2]):
+                _load_partitioned(ModelBase, engine, store, partition,
+                                  progress, *block)
+    progress.done()
+    store._fetch = None
     return store
 
 
+def _create_batch(ModelBase, session, store, model, model_name, instances,
+                  links, lookups, progress, source, defaults=None,
+                  coerced=None, nested_coerced=None):
+    '''create all objects of a block with `from_fixture_batch()`
+
+    Keys are saved in the store only after the whole block is created,
+    so rows can not reference keys defined in the same block.
+    '''
+    coerced = coerced or [None] * len(instances)
+    nodes = [_Node(model_name, None, fields.get('__key__'), fields, defaults,
+                   coerced=row_coerced, nested_coerced=nested_coerced)
+             for fields, row_coerced in zip(instances, coerced)]
+    for node in nodes:
+        node.resolved = _resolve_values(
+            ModelBase, session, store, node, links, lookups)
+        _run(ModelBase, session, store, node.resolved.children[::-1],
+             links, lookups)
+    objs = model.from_fixture_batch(
+        session, [node.resolved.scalars for node in nodes])
+    if len(objs) != len(nodes):
+        msg = '{}.from_fixture_batch() returned {} objects, expected {}'
+        raise Exception(msg.format(model_name, len(objs), len(nodes)))
+    for node, obj in zip(nodes, objs):
+        node.obj = obj
+        stack = []
+        _finish_obj(ModelBase, store, node, links, stack)
+        _run(ModelBase, session, store, stack, links, lookups)
+        session.add(obj)
+        progress.row(model_name, source)
+
+
+def _create_shard(ModelBase, engine, model, model_name, creator, batch,
+                  instances, defaults, coerced):
+    '''create and commit objects of a shard on its own Session
+
+    @return {key: obj} of created objects (detached, not expired)
+    '''
+    store = Store()
+    with Session(bind=engine, expire_on_commit=False) as session:
+        if batch:
+            _create_batch(ModelBase, session, store, model, model_name,
+                          instances, None, None, NullProgress(), None,
+                          defaults, coerced)
+        else:
+            for fields, row_coerced in zip(instances, coerced):
+                obj = _create_obj(
+                    ModelBase, session, store, model_name, creator,
+                    fields.get('__key__'), fields, defaults=defaults,
+                    coerced=row_coerced)
+                session.add(obj)
+        session.commit()
+    return store._store
+
+
+def _load_partitioned(ModelBase, engine, store, workers, progress, source,
+                      model, model_name, creator, batch, instances, defaults,
+                      coerced):
+    '''create objects of a block split into shards, concurrently'''
+    # build shared index before starting threads
+    get_relationship_index(ModelBase)
+
+    def create(shard):
+        return _create_shard(ModelBase, engine, model, model_name, creator,
+                             batch, instances[shard], defaults,
+                             coerced[shard])
+
+    slices = shards(len(instances), workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for shard, objs in zip(slices, pool.map(create, slices)):
+            for key, obj in objs.items():
+                store.put(key, obj)
+            for _ in instances[shard]:
+                progress.row(model_name, source)
+
+
+# elapsed: seconds spent loading into target
+TargetResult = namedtuple('TargetResult', 'target store elapsed')
+
+
+def load_many(ModelBase, targets, fixture_text, loader=None, workers=None,
+              **kwargs):
+    '''load the same fixtures into many databases, concurrently
+
+    Fixtures are parsed only once. Each target is loaded in a thread
+    using its own Session, extra `kwargs` are passed to `load()`.
+
+    :param targets: Engines (or DB URLs)
+    :param workers: max number of threads (default: one per target)
+    @return list of TargetResult, in the same order as targets
+    '''
+    sqlalchemy.orm.configure_mappers()
+    fixtures = parse(fixture_text, loader)
+    # build shared index before starting threads
+    get_relationship_index(ModelBase)
+
+    def load_target(target):
+        start = time.perf_counter()
+        if isinstance(target, str):
+            engine = sqlalchemy.create_engine(target)
+        else:
+            engine = target
+        try:
+            with Session(bind=engine) as session:
+                store = load(ModelBase, session, fixtures, **kwargs)
+        finally:
+            if engine is not target:
+                engine.dispose()
+        return TargetResult(target, store, time.perf_counter() - start)
+
+    targets = list(targets)
+    with ThreadPoolExecutor(max_workers=workers or len(targets) or 1) as pool:
+        return list(pool.map(load_target, targets))
+
 
 #############################
 ### Core SQLAlchemy
 
 
-async def _insert_row(tables, connection, store, table_name, key, values):
+class _TablePlan:
+    """
+    Data needed to insert rows into a table, computed once per table.
+
+    The same INSERT statement is used for all rows, rows with the same
+    set of columns reuse the compiled statement from SQLAlchemy cache.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        # column key -> name of column referenced by FK (None if not a FK),
+        # computed only for columns used by fixtures
+        self._fk_columns = {}
+        # columns where `!file` is read as bytes
+        self.binary = {col.key for col in table.c
+                       if python_type(col.type) is bytes}
+        self.converters = column_converters(
+            (col.key, col) for col in table.c if not col.foreign_keys)
+        self.insert = table.insert().returning(table)
+
+    def fk_column(self, name):
+        '''@return name of column referenced by FK column `name`,
+        None if not a FK. Raise KeyError if table has no such column.
+        '''
+        try:
+            return self._fk_columns[name]
+        except KeyError:
+            col = self.table.c[name]
+        fk_col = None
+        if col.foreign_keys:
+            if len(col.foreign_keys) != 1:
+                msg = 'Column {}.{} has more than one foreign key.'
+                raise Exception(msg.format(self.table, name))
+            fk = next(iter(col.foreign_keys))
+            fk_col = fk.target_fullname.split('.')[-1]
+        self._fk_columns[name] = fk_col
+        return fk_col
+
+    def defaults(self, defaults):
+        '''classify `__defaults__` values of an entry'''
+        if defaults is None:
+            return None
+        plain, values = {}, {}
+        for name, value in defaults.items():
+            try:
+                fk_col = self.fk_column(name)
+            except KeyError:
+                raise Exception(
+                    f'Inavlid column name: {self.table}.{name} = {value}')
+            if fk_col is None and not isinstance(value, FileRef):
+                plain[name] = value
+            else:
+                values[name] = value
+        return _Defaults(plain, values)
+
+
+async def _insert_row(plan, connection, store, key, values, lookups,
+                      defaults=None, coerced=None):
     """
     Create and insert a row into the given table from the provided values.
 
-    :param tables: Dictionary of SQLAlchemy Core tables (replaces models).
+    :param plan: _TablePlan of table where row is inserted.
     :param connection: SQLAlchemy connection object for executing queries.
     :param store: Store of previously created objects.
-    :param table_name: Name of the table (string).
     :param key: Optional key for the object in the store.
     :param values: Column values for the row to be inserted.
+    :param lookups: _Lookups of rows already in the DB.
+    :param defaults: _Defaults of the entry (optional).
+    :param coerced: Values converted to column types (optional).
     """
-    # Get reference to the SQLAlchemy Core table
-    table = tables[table_name]
-
     # Resolve references in values (i.e., nested objects)
-    resolved_values = {}
-    for name, value in values.items():
-        # print('sqlaf - insert row', table, name, value)
-        col = table.c.get(name)
-        if col is None:
-            raise Exception(f'Inavlid column name: {table}.{name} = {value}')
-        if col.foreign_keys:
-            assert len(col.foreign_keys) == 1
-            fk = next(iter(col.foreign_keys))
-            fk_col = fk.target_fullname.split('.')[-1]
-            obj = store.get(value)
-            resolved_values[name] = getattr(obj, fk_col)
-        else:
-            resolved_values[name] = value
+    # `!file` values are open only while the row is inserted
+    if defaults is None:
+        resolved_values = {}
+        items = values.items()
+    else:
+        resolved_values, items = defaults.layer(values)
+    with ExitStack() as files:
+        for name, value in items:
+            if name == '__key__':
+                continue
+            try:
+                fk_col = plan.fk_column(name)
+            except KeyError:
+                raise Exception(
+                    f'Inavlid column name: {plan.table}.{name} = {value}')
+            if fk_col is not None:
+                if is_lookup(value):
+                    obj = lookups.get(value)
+                else:
+                    obj = store.get(value)
+                resolved_values[name] = getattr(obj, fk_col)
+            elif isinstance(value, FileRef):
+                resolved_values[name] = files.enter_context(
+                    value.open(name in plan.binary))
+            else:
+                resolved_values[name] = value
+        if coerced:
+            resolved_values.update(coerced)
 
-    # Execute insert statement
-    insert_stmt = table.insert().values(**resolved_values).returning(table)
-    result = await connection.execute(insert_stmt)
-    obj = result.fetchone()
+        # Execute insert statement
+        result = await connection.execute(plan.insert, resolved_values)
+        obj = result.fetchone()
 
 
     # Store the inserted row if a key is provided
     if key:
-        store.put(key, obj)
+        store.put(key, obj, plan.table)
 
     return obj
 
 
-async def load_core(metadata, connection, fixture_text, loader=None):
+async def load_core(metadata, connection, fixture_text, loader=None,
+                    stats=False, max_statements=None, memprofile=False,
+                    progress=None, store=None, partition=None):
     """
     Load data from YAML into the database using SQLAlchemy Core.
 
     :param metadata: SQLAlchemy MetaData object.
     :param connection: SQLAlchemy connection object.
-    :param fixture_text: YAML string with data to load.
+    :param fixture_text: YAML string with data to load,
+                         or sequence of (source name, YAML string),
+                         or Fixtures returned by `parse()`.
     :param loader: YAML loader (optional).
+    :param stats: Count SQL statements, available on `store.stats`.
+    :param max_statements: Raise StatementBudgetExceeded when more SQL
+                           statements are executed (implies `stats`).
+    :param memprofile: Measure memory used per phase and table (True or
+                       a MemoryProfile), available on `store.memory`.
+    :param progress: Callable taking a ProgressEvent (or a Progress),
+                     called periodically while rows are inserted.
+    :param store: Store used (and returned) by the load, i.e. with keys
+                  from a previous load (`Store.from_file()`).
+    :param partition: Number of workers. Large blocks whose keys are not
+                      referenced are split into shards, each inserted on
+                      its own connection. Used only if `connection` is
+                      not in a transaction, the transaction begun by the
+                      load is committed before shards are inserted.
+                      If a shard fails, the load and shards already
+                      inserted are committed.
     """
-    if loader is None:
-        loader = yaml.FullLoader
-    data = yaml.load(fixture_text, Loader=loader)
+    profile = _memory_profile(memprofile)
+    with profile:
+        store = await _load_core(metadata, connection, fixture_text, loader,
+                                 stats, max_statements, profile,
+                                 _progress(progress), store, partition)
+    if memprofile:
+        store.memory = profile
+    return store
 
-    if not isinstance(data, list):
-        raise ValueError('Top level YAML should be a sequence (list).')
 
-    # Reflect the tables from the metadata
-    tables = {table.name: table for table in metadata.sorted_tables}
+async def _fetch_core(store, tables, connection):
+    '''select rows of saved keys referenced by fixtures'''
+    for name, pk_keys in store._index_groups(store._wanted).items():
+        table = tables[name]
+        pk_cols = list(table.primary_key)
+        found = {}
+        for chunk in _chunks(pk_keys):
+            stmt = table.select().where(_Lookups._where(pk_cols, chunk))
+            for row in await connection.execute(stmt):
+                found[tuple(getattr(row, col.key) for col in pk_cols)] = row
+        store._put_fetched(name, pk_keys, found, table)
 
-    store = Store()
 
-    # Iterate through the YAML data
-    for model_entry in data:
-        if len(model_entry) != 1:
-            raise ValueError('Each YAML entry must contain only one table.')
+async def _insert_partitioned(engine, store, lookups, workers, stats,
+                              progress, source, plan, instances, defaults,
+                              coerced):
+    '''insert rows of a block split into shards, concurrently
 
-        table_name, instances = model_entry.popitem()
+    :param stats: StatementStats counting statements of shards, or None
+    '''
+    table_name = plan.table.name
 
-        if instances is None:
-            continue
+    async def insert(shard):
+        async with engine.begin() as conn:
+            counting = (stats.listen(conn.sync_connection)
+                        if stats is not None else nullcontext())
+            with counting:
+                for fields, row_coerced in zip(instances[shard],
+                                               coerced[shard]):
+                    await _insert_row(plan, conn, store,
+                                      fields.get('__key__'), fields,
+                                      lookups, defaults, row_coerced)
+                    progress.row(table_name, source)
 
-        if not isinstance(instances, list):
-            raise ValueError(f'`{table_name}` must contain a sequence (list).')
+    await asyncio.gather(*(insert(shard)
+                           for shard in shards(len(instances), workers)))
 
-        for fields in instances:
-            key = fields.pop('__key__', None)
-            await _insert_row(tables, connection, store, table_name, key, fields)
+
+async def _load_core(metadata, connection, fixture_text, loader,
+                     stats, max_statements, profile, progress, store=None,
+                     partition=None):
+    sources = _parse(fixture_text, loader, profile)
+
+    # Reflect the tables from the metadata
+    tables = {table.name: table for table in metadata.sorted_tables}
+    plans = {}  # table name -> _TablePlan
+
+    if store is None:
+        store = Store()
+    references = list(_core_references(tables, sources))
+    store._collect(references)
+    # events are registered on the sync Connection of an AsyncConnection
+    counting = _statement_stats(
+        store, [getattr(connection, 'sync_connection', connection)],
+        stats, max_statements)
+
+    lookups = _Lookups()
+    lookups.collect(references)
+
+    # the transaction of connection is committed before inserting
+    # shards, only if it is begun by the load
+    if partition and not connection.in_transaction():
+        engine = shared_engine(connection)
+    else:
+        engine = None
+    if engine is not None:
+        referenced = referenced_keys(sources)
+    partitioned = []  # blocks inserted after connection is committed
+
+    # Iterate through the YAML data
+    progress.start()
+    with counting, profile.phase('insert'):
+        if lookups:
+            await lookups.resolve_core(tables, connection)
+        await _fetch_core(store, tables, connection)
+        for source, table_name, defaults, instances in iter_entries(
+                sources):
+            plan = plans.get(table_name)
+            if plan is None:
+                plan = plans[table_name] = _TablePlan(tables[table_name])
+            offset = 0 if defaults is None else 1
+            defaults = plan.defaults(defaults)
+            coerced = _coerce(table_name, plan.converters, instances,
+                              defaults, offset)
+            if engine is not None and partitionable(
+                    instances, referenced, partition):
+                partitioned.append((source, plan, instances, defaults,
+                                    coerced))
+                continue
+            with profile.mapper(table_name):
+                for fields, row_coerced in zip(instances, coerced):
+                    key = fields.get('__key__')
+                    await _insert_row(plan, connection, store, key, fields,
+                                      lookups, defaults, row_coerced)
+                    progress.row(table_name, source)
+        if partitioned:
+            await connection.commit()
+        for block in partitioned:
+            with profile.mapper(block[1].table.name):
+                await _insert_partitioned(
+                    engine, store, lookups, partition,
+                    store.stats if stats or max_statements is not None
+                    else None, progress, *block)
+    progress.done()
 
     # Commit the transaction
     # await connection.commit()
 
     return store
+
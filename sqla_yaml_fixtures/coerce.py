@@ -0,0 +1,142 @@
+'''convert YAML values to the python type expected by columns
+
+Values are converted one column at a time for a whole entry (block of
+rows), each distinct value is converted only once.
+'''
+
+import datetime
+import decimal
+
+import sqlalchemy
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return datetime.date.fromisoformat(value)
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.fromisoformat(value)
+
+
+def _to_time(value):
+    return datetime.time.fromisoformat(value)
+
+
+def _to_decimal(value):
+    try:
+        return decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        raise ValueError('invalid decimal: {!r}'.format(value))
+
+
+def _enum_converter(column_type):
+    enum_class = column_type.enum_class
+    if enum_class is None:
+        choices = set(column_type.enums)
+
+        def to_enum(value):
+            if value not in choices:
+                raise ValueError('{!r} is not one of: {}'.format(
+                    value, ', '.join(column_type.enums)))
+            return value
+        return to_enum
+
+    def to_enum_member(value):
+        try:
+            return enum_class[value]
+        except KeyError:
+            try:
+                return enum_class(value)
+            except ValueError:
+                raise ValueError('{!r} is not a member of {}'.format(
+                    value, enum_class.__name__))
+    return to_enum_member
+
+
+# column type -> (converter, python types used without conversion)
+_CONVERTERS = (
+    (sqlalchemy.DateTime, _to_datetime, (datetime.datetime,)),
+    (sqlalchemy.Date, _to_date, (datetime.date,)),
+    (sqlalchemy.Time, _to_time, (datetime.time,)),
+)
+
+
+def converter(column_type):
+    '''@return (converter, ok types) for a column type, or None
+
+    `ok types` are python types of values used without conversion.
+    '''
+    if isinstance(column_type, sqlalchemy.types.TypeDecorator):
+        column_type = column_type.impl
+    if isinstance(column_type, sqlalchemy.Enum):
+        ok = (column_type.enum_class,) if column_type.enum_class else ()
+        return _enum_converter(column_type), ok
+    if isinstance(column_type, sqlalchemy.Numeric):
+        if not column_type.asdecimal:
+            return None
+        return _to_decimal, (decimal.Decimal,)
+    for type_class, func, ok in _CONVERTERS:
+        if isinstance(column_type, type_class):
+            return func, ok
+    return None
+
+
+def column_converters(columns):
+    '''@return {column key: (converter, ok types)} of columns to convert
+
+    :param columns: iterable of (key, Column)
+    '''
+    converters = {}
+    for key, column in columns:
+        conv = converter(column.type)
+        if conv is not None:
+            converters[key] = conv
+    return converters
+
+
+def coerce_block(converters, rows):
+    '''convert values of rows, one column at a time
+
+    Parsed rows are not modified.
+    @return (list of (dict or None) converted values for each row,
+             list of (row index, column key, error message))
+    '''
+    converted = [None] * len(rows)
+    errors = []
+    for key, (func, ok) in converters.items():
+        cache = {}  # (type, value) -> converted
+        for idx, row in enumerate(rows):
+            value = row.get(key)
+            # exact type: a datetime is also a date, a bool also an int
+            if value is None or type(value) in ok:
+                continue
+            if not isinstance(value, (str, int, float, datetime.date)):
+                continue  # i.e. references, lookups, files
+            try:
+                new = cache[(type(value), value)]
+            except KeyError:
+                try:
+                    new = func(value)
+                except (ValueError, TypeError) as exp:
+                    errors.append((idx, key, str(exp)))
+                    continue
+                cache[(type(value), value)] = new
+            if converted[idx] is None:
+                converted[idx] = {}
+            converted[idx][key] = new
+    return converted, errors
+
+
+def format_errors(name, errors, offset=0):
+    '''one line per (column, message) with positions of rows'''
+    grouped = {}
+    for idx, key, msg in errors:
+        grouped.setdefault((key, msg), []).append(str(idx + offset))
+    return '\n'.join(
+        'Invalid value for {}.{} (rows {}): {}'.format(
+            name, key, ', '.join(rows), msg)
+        for (key, msg), rows in grouped.items())
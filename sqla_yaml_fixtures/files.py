@@ -0,0 +1,102 @@
+'''`!file <path>` YAML tag, column values read from external files
+
+Files are not read while parsing, only when the row using it is created.
+Paths are relative to the directory of the fixture source.
+'''
+
+import os
+import mmap
+from contextlib import contextmanager
+
+import yaml
+
+
+# files bigger than this are memory-mapped instead of read (core only)
+MMAP_SIZE = 1024 * 1024
+
+
+class FileRef:
+    '''reference to a file, value of `!file` tag
+
+    :var path (str): file path (relative to fixture source directory)
+    '''
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return 'FileRef({!r})'.format(self.path)
+
+    def __eq__(self, other):
+        return isinstance(other, FileRef) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def read(self, binary=False):
+        '''@return file content, bytes if binary else str (UTF-8)'''
+        if binary:
+            with open(self.path, 'rb') as fp:
+                return fp.read()
+        with open(self.path, encoding='utf-8') as fp:
+            return fp.read()
+
+    @contextmanager
+    def open(self, binary=False):
+        '''file content, valid only inside the `with` block
+
+        Large binary files are memory-mapped, a memoryview is returned.
+        '''
+        if not binary or os.path.getsize(self.path) < MMAP_SIZE:
+            yield self.read(binary)
+            return
+        with open(self.path, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            view.release()
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # still exported by DB driver, closed when released
+
+
+def file_constructor(loader, node):
+    '''YAML constructor for `!file` tag
+
+    Register on a custom loader with:
+    `yaml.add_constructor('!file', file_constructor, Loader=MyLoader)`
+    '''
+    path = loader.construct_scalar(node)
+    base_dir = getattr(loader, 'base_dir', None)
+    if base_dir:
+        path = os.path.join(base_dir, path)
+    return FileRef(path)
+
+
+class FixtureLoader(yaml.FullLoader):
+    '''default loader, yaml.FullLoader with `!file` tag'''
+
+FixtureLoader.add_constructor('!file', file_constructor)
+
+
+def load_yaml(text, loader, source=None):
+    '''parse YAML text, `!file` paths are relative to source directory'''
+    instance = loader(text)
+    if source:
+        instance.base_dir = os.path.dirname(source)
+    try:
+        return instance.get_single_data()
+    finally:
+        instance.dispose()
+
+
+def python_type(column_type):
+    '''python type of column values, None if unknown'''
+    try:
+        return column_type.python_type
+    except NotImplementedError:
+        return None
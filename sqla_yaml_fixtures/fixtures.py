@@ -0,0 +1,96 @@
+'''parsed fixtures, shared by load and validation'''
+
+from .files import FixtureLoader, load_yaml
+from .include import IncludeCache, include_sources, is_include
+
+
+def is_lookup(value):
+    '''check if value is a lookup: `{lookup: <name>, by: {<col>: <value>}}`'''
+    return (isinstance(value, dict) and len(value) == 2
+            and 'lookup' in value and isinstance(value.get('by'), dict))
+
+
+class Fixtures:
+    '''parsed fixtures, can be loaded many times (data is not modified)
+
+    :var sources (list): (source name, data), included files are placed
+                         before the source including them
+    :var includes (dict): source name -> [paths of included files],
+                          dependency graph of `__include__` entries
+    '''
+    def __init__(self, sources, includes=None):
+        self.sources = sources
+        self.includes = includes or {}
+
+    def files(self):
+        '''@return set of paths of all sources and included files'''
+        paths = {name for name, _ in self.sources if name}
+        for included in self.includes.values():
+            paths.update(included)
+        return paths
+
+
+def parse(fixture_text, loader=None, include_cache=None, render=None):
+    '''parse YAML fixtures once, to be loaded by `load()` / `load_core()`
+
+    :param fixture_text: YAML string, or sequence of (name, YAML string),
+                         or Fixtures (already parsed)
+    :param include_cache: IncludeCache of included files
+                          (default: new cache used only by this call)
+    :param render: callable(text) -> YAML text applied to included files,
+                   i.e. the jinja2 rendering already applied to sources
+    @return Fixtures
+    '''
+    if isinstance(fixture_text, Fixtures):
+        return fixture_text
+    if loader is None:
+        loader = FixtureLoader
+    if isinstance(fixture_text, str):
+        fixture_text = [(None, fixture_text)]
+    sources = []
+    for name, text in fixture_text:
+        # Data should be sequence of entry per mapper name
+        # to enforce that FKs (__key__ entries) are defined first
+        data = load_yaml(text, loader, name)
+        if data is None:
+            data = []  # empty (or only comments) source
+        if not isinstance(data, list):
+            raise ValueError('Top level YAML should be sequence (list).')
+        sources.append((name, data))
+    if include_cache is None:
+        include_cache = IncludeCache()
+    return Fixtures(*include_sources(sources, loader, include_cache,
+                                     render=render))
+
+
+def iter_entries(sources):
+    '''yield (source name, mapper name, defaults, instances)
+    of non-empty entries
+
+    `__defaults__` (dict or None) is taken from the first instance.
+    '''
+    for source, data in sources:
+        for model_entry in data:
+            if is_include(model_entry):
+                continue  # already in sources
+            if len(model_entry) != 1:
+                msg = ('Sequence item must contain only one mapper,'
+                       ' found: {}.')
+                raise ValueError(msg.format(', '.join(model_entry.keys())))
+
+            model_name, instances = next(iter(model_entry.items()))
+            if instances is None:
+                # Ignore empty entry
+                continue
+            if not isinstance(instances, list):
+                msg = '`{}` must contain a sequence(list).'
+                raise ValueError(msg.format(model_name))
+            defaults = None
+            first = instances[0] if instances else None
+            if isinstance(first, dict) and '__defaults__' in first:
+                if len(first) != 1:
+                    msg = '`{}`: `__defaults__` must be the only field.'
+                    raise ValueError(msg.format(model_name))
+                defaults = first['__defaults__']
+                instances = instances[1:]
+            yield source, model_name, defaults, instances
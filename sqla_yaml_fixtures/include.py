@@ -0,0 +1,201 @@
+'''`__include__` top-level entry, fixture files included by other files
+
+    - __include__: base/users.yaml
+    - __include__: [base/users.yaml, base/countries.yaml]
+
+Paths are relative to the directory of the including source.
+Included files are loaded before the entries of the including source,
+each file only once per load (even if included by many sources).
+Included files are rendered like the sources (i.e. jinja2 templates)
+when a `render` function is given.
+'''
+
+import io
+import os
+import pickle
+import hashlib
+
+import yaml
+
+from .files import load_yaml
+
+
+def _qualname(func):
+    return '{}.{}'.format(func.__module__, func.__qualname__)
+
+
+class _Unpickler(pickle.Unpickler):
+    '''unpickle only YAML data types, no other callable is loaded'''
+    SAFE = {
+        ('builtins', 'set'), ('builtins', 'frozenset'),
+        ('datetime', 'date'), ('datetime', 'datetime'),
+        ('datetime', 'time'), ('datetime', 'timedelta'),
+        ('datetime', 'timezone'),
+        ('sqla_yaml_fixtures.files', 'FileRef'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.SAFE:
+            raise pickle.UnpicklingError(
+                'global {}.{} is not allowed'.format(module, name))
+        return super().find_class(module, name)
+
+
+class IncludeCache:
+    '''parsed included files, re-used while the file is not modified
+
+    A file is parsed again only when both its mtime and its content
+    (SHA-1) changed. The cache can be saved to a file and used by later
+    runs. Only YAML data types are loaded from the cache file, a file
+    that can not be loaded (corrupted, or data from a custom loader)
+    gives an empty cache.
+
+    The cache is owned by its user (a run of the cmd, the server),
+    entries are kept until the cache is released.
+
+    :var entries (dict): (path, loader name, render name)
+                         -> (mtime_ns, digest, data)
+    '''
+
+    def __init__(self):
+        self.entries = {}
+
+    @classmethod
+    def from_file(cls, path):
+        '''create IncludeCache saved by `save()`, empty if no file'''
+        cache = cls()
+        try:
+            with open(path, 'rb') as fp:
+                entries = _Unpickler(io.BytesIO(fp.read())).load()
+        except Exception:
+            return cache  # no file, not a cache file or not safe to load
+        if isinstance(entries, dict):
+            cache.entries = entries
+        return cache
+
+    def save(self, path):
+        with open(path, 'wb') as fp:
+            pickle.dump(self.entries, fp)
+
+    def parse(self, path, loader, render=None):
+        '''@return parsed data of file
+
+        :param render: callable(text) -> YAML text, applied before parsing
+        '''
+        key = (os.path.realpath(path), _qualname(loader),
+               _qualname(render) if render else None)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.entries.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[2]
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if cached is not None and cached[1] == digest:
+            data = cached[2]
+        else:
+            text = content.decode('utf-8')
+            if render:
+                text = render(text)
+            data = load_yaml(text, loader, path)
+        self.entries[key] = (mtime, digest, data)
+        return data
+
+
+def is_include(entry):
+    '''@return True if top-level entry is an `__include__`'''
+    return isinstance(entry, dict) and '__include__' in entry
+
+
+def _include_paths(entry):
+    '''@return list of included paths, None if invalid'''
+    if len(entry) != 1:
+        return None
+    paths = entry['__include__']
+    if isinstance(paths, str):
+        paths = [paths]
+    if (not isinstance(paths, list)
+            or not all(isinstance(path, str) for path in paths)):
+        return None
+    return paths
+
+
+def _raise(source, path, msg):
+    raise ValueError('{}: {}: {}'.format(source, path, msg))
+
+
+def include_sources(sources, loader, cache, on_error=None, render=None):
+    '''add included files to parsed sources
+
+    Included files are placed before the source that includes them.
+    A source already loaded (i.e. also included by a previous source)
+    is skipped.
+
+    :param cache: IncludeCache used to parse included files
+    :param on_error: callable(source, path, message), default raises
+                     ValueError
+    :param render: callable(text) -> YAML text, applied to included files
+    @return (list of (name, data), includes)
+            includes: {source name: [paths of included files]}
+    '''
+    on_error = on_error or _raise
+    result = []
+    includes = {}
+    loaded = set()  # real paths of sources added to result
+
+    # stack of (expanded, name, data, real path, ancestors), ancestors
+    # are real paths of sources including it (used to detect cycles).
+    # A source is visited twice: first to push its includes on top of
+    # it, then (expanded) to be added to result.
+    stack = [(False, name, data, None, ())
+             for name, data in reversed(sources)]
+    while stack:
+        expanded, name, data, real, ancestors = stack.pop()
+        if real is None and name and os.path.isfile(name):
+            real = os.path.realpath(name)
+        if real in loaded:
+            continue
+        if expanded:
+            if real:
+                loaded.add(real)
+            result.append((name, data))
+            continue
+        stack.append((True, name, data, real, ancestors))
+
+        chain = ancestors + ((real,) if real else ())
+        children = []
+        for idx, entry in enumerate(data):
+            if not is_include(entry):
+                continue
+            err_path = '[{}].__include__'.format(idx)
+            paths = _include_paths(entry)
+            if paths is None:
+                on_error(name, err_path,
+                         'must be a path or list of paths (only field).')
+                continue
+            base_dir = os.path.dirname(name) if name else ''
+            for rel_path in paths:
+                path = os.path.normpath(os.path.join(base_dir, rel_path))
+                includes.setdefault(name, []).append(path)
+                inc_real = os.path.realpath(path)
+                if inc_real in chain:
+                    on_error(name, err_path,
+                             'include cycle: {}'.format(path))
+                    continue
+                if inc_real in loaded:
+                    continue
+                try:
+                    inc_data = cache.parse(path, loader, render)
+                except (OSError, yaml.YAMLError) as exp:
+                    on_error(name, err_path, 'can not include {}: {}'.format(
+                        path, exp))
+                    continue
+                if inc_data is None:
+                    inc_data = []  # empty (or only comments) file
+                if not isinstance(inc_data, list):
+                    on_error(path, '', 'Top level YAML should be'
+                             ' sequence (list).')
+                    continue
+                children.append((False, path, inc_data, inc_real, chain))
+        stack.extend(reversed(children))
+    return result, includes
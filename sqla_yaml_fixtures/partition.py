@@ -0,0 +1,70 @@
+'''split large blocks into shards inserted concurrently
+
+Only blocks whose keys are never referenced can be partitioned.
+Each shard is inserted and committed on its own connection, after the
+rest of the load is committed (so foreign keys to rows of the load
+are valid on other connections).
+'''
+
+
+# blocks with fewer rows are not partitioned
+PARTITION_MIN_ROWS = 10000
+
+
+def referenced_keys(sources):
+    '''@return set of keys that might be referenced in parsed sources
+
+    Any string value (except `__key__`) is taken as a reference, only
+    the part before the first dot is used.
+    '''
+    keys = set()
+    stack = [data for _, data in sources]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            keys.add(value.split('.')[0])
+        elif isinstance(value, dict):
+            stack.extend(val for name, val in value.items()
+                         if name != '__key__')
+        elif isinstance(value, list):
+            stack.extend(value)
+    return keys
+
+
+def shared_engine(bind):
+    '''@return Engine (or AsyncEngine) of a Session bind or Connection
+
+    None if connections do not share the database (in-memory SQLite).
+    '''
+    engine = bind.engine
+    url = engine.url
+    if (url.get_backend_name() == 'sqlite'
+            and url.database in (None, '', ':memory:')):
+        return None
+    return engine
+
+
+def partitionable(rows, referenced, workers, columns=None):
+    '''@return True if rows of a block can be split into shards
+
+    :param referenced: set of keys returned by `referenced_keys()`
+    :param workers: number of shards
+    :param columns: names of the only fields allowed on rows (ORM column
+                    attributes), other fields (relationships, `__init__`
+                    params) might reference keys or lookups of the load
+    '''
+    if not workers or workers < 2 or len(rows) < PARTITION_MIN_ROWS:
+        return False
+    for row in rows:
+        if row.get('__key__') in referenced:
+            return False
+        if columns is not None and any(
+                name not in columns for name in row if name != '__key__'):
+            return False
+    return True
+
+
+def shards(count, workers):
+    '''@return list of (contiguous) slices, one per worker'''
+    size = -(-count // workers)
+    return [slice(start, start + size) for start in range(0, count, size)]
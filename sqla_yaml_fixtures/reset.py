@@ -0,0 +1,106 @@
+'''delete all data from DB tables, keeping the schema'''
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+
+def _delete_levels(metadata):
+    '''group tables in the order they can be deleted
+
+    Tables in a group do not reference each other and are only referenced
+    by tables in previous groups, so a group can be deleted concurrently.
+    @return list of list of tables
+    '''
+    referrers = {table: set() for table in metadata.sorted_tables}
+    for table in metadata.sorted_tables:
+        for fk in table.foreign_keys:
+            if fk.column.table is not table and fk.column.table in referrers:
+                referrers[fk.column.table].add(table)
+    level = {}
+    for table in reversed(metadata.sorted_tables):
+        level[table] = max(
+            (level.get(ref, 0) + 1 for ref in referrers[table]), default=0)
+    levels = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for table in reversed(metadata.sorted_tables):
+        levels[level[table]].append(table)
+    return levels
+
+
+def _execute(engine, statements):
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(statement)
+
+
+def _reset_postgresql(engine, tables, quote):
+    # no CASCADE: fails instead of emptying tables not in metadata
+    # that reference these tables
+    names = ', '.join(quote(table) for table in tables)
+    _execute(engine, [text(
+        'TRUNCATE TABLE {} RESTART IDENTITY'.format(names))])
+
+
+def _reset_mysql(engine, tables, quote, executor):
+    # FK checks are disabled per connection, tables can be truncated in
+    # any order. TRUNCATE resets AUTO_INCREMENT.
+    def truncate(table):
+        _execute(engine, [
+            text('SET FOREIGN_KEY_CHECKS=0'),
+            text('TRUNCATE TABLE {}'.format(quote(table))),
+            text('SET FOREIGN_KEY_CHECKS=1'),
+        ])
+    list(executor.map(truncate, tables))
+
+
+def _reset_sqlite(engine, levels):
+    # SQLite allows a single writer, no point in concurrency
+    tables = [table for level in levels for table in level]
+    with engine.begin() as conn:
+        for table in tables:
+            conn.execute(table.delete())
+        # reset AUTOINCREMENT counters
+        has_sequence = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE name='sqlite_sequence'"
+        )).first()
+        if has_sequence and tables:
+            params = {'t{}'.format(idx): table.name
+                      for idx, table in enumerate(tables)}
+            conn.execute(text(
+                'DELETE FROM sqlite_sequence WHERE name IN ({})'.format(
+                    ', '.join(':' + name for name in params))), params)
+
+
+def reset_data(engine, metadata, workers=None):
+    '''delete data from all tables in metadata, keeping the schema
+
+    Much faster than `drop_all()` + `create_all()`, and does not touch
+    tables that are not in metadata (i.e. alembic version).
+
+    - postgresql: single `TRUNCATE ... RESTART IDENTITY` (fails if a
+      table not in metadata references a table in metadata)
+    - mysql: `TRUNCATE` with foreign key checks disabled, concurrently
+    - sqlite: `DELETE` in reverse dependency order, reset AUTOINCREMENT
+    - others: `DELETE` in reverse dependency order, tables that do
+      not depend on each other are deleted concurrently
+
+    :param workers: max number of concurrent connections
+    '''
+    levels = _delete_levels(metadata)
+    tables = [table for level in levels for table in level]
+    quote = engine.dialect.identifier_preparer.format_table
+    dialect = engine.dialect.name
+    if dialect == 'postgresql':
+        if tables:
+            _reset_postgresql(engine, tables, quote)
+    elif dialect == 'sqlite':
+        _reset_sqlite(engine, levels)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            if dialect in ('mysql', 'mariadb'):
+                _reset_mysql(engine, tables, quote, executor)
+            else:
+                for level in levels:
+                    list(executor.map(
+                        lambda table: _execute(engine, [table.delete()]),
+                        level))
@@ -0,0 +1,102 @@
+'''mappers of a declarative base and their relationships'''
+
+
+def from_registry(Base, model_name):
+    """Compatibility for SQLAlchemy 1.4 changes
+
+    https://github.com/sqlalchemy/sqlalchemy/commit/450f5c0d6519a439f4025c3892fe4cf3ee2d892c
+    """
+    if hasattr(Base, '_decl_class_registry'): # SQLAlchemy < 1.4
+        return Base._decl_class_registry[model_name]
+    else:
+        return Base.registry._class_registry[model_name]
+
+
+
+class RelationshipIndex:
+    '''Relationships of all mappers in a registry
+
+    Maps (source mapper, target mapper) -> list of relationships from source
+    to target. Built once per registry, see `get_relationship_index()`.
+    '''
+
+    def __init__(self, registry):
+        self.size = len(registry.mappers)
+        self._index = {}
+        for mapper in registry.mappers:
+            for rel in mapper.relationships:
+                self._index.setdefault((mapper, rel.mapper), []).append(rel)
+
+    def find(self, src_mapper, target_mapper):
+        '''all relationships from src_mapper to target_mapper
+
+        target_mapper might be a sub-class of the relationship target.
+        '''
+        for mapper in target_mapper.iterate_to_root():
+            rels = self._index.get((src_mapper, mapper))
+            if rels:
+                return rels
+        return []
+
+    def find_one(self, src_mapper, target_mapper, exclude=(), key=None):
+        '''single relationship from src_mapper to target_mapper
+
+        :param exclude: relationships not to be considered, used to
+                        disambiguate self-referential paths.
+        :param key: name of the relationship to use, explicit
+                    disambiguation (see `fixture_target()`)
+        @return relationship
+        '''
+        rels = [rel for rel in self.find(src_mapper, target_mapper)
+                if rel not in exclude]
+        if key is not None:
+            for rel in rels:
+                if rel.key == key:
+                    return rel
+            msg = 'Mapper `{}` has no relationship `{}` to type `{}`'
+            raise Exception(msg.format(src_mapper.class_.__name__, key,
+                                       target_mapper.class_.__name__))
+        if len(rels) == 1:
+            return rels[0]
+        if not rels:
+            msg = 'Mapper `{}` has no field with relationship to type `{}`'
+            raise Exception(msg.format(src_mapper.class_.__name__,
+                                       target_mapper.class_.__name__))
+        msg = ('Mapper `{}` has more than one relationship to type `{}`: {}.'
+               ' Set `info={{"{}": <name>}}` on the relationship'
+               ' to `{}` to choose one.')
+        raise Exception(msg.format(
+            src_mapper.class_.__name__, target_mapper.class_.__name__,
+            ', '.join(sorted(rel.key for rel in rels)), TARGET_INFO,
+            src_mapper.class_.__name__))
+
+
+# key of relationship `info` naming the relationship of an association
+# object used by a list of references
+TARGET_INFO = 'fixture_target'
+
+
+def fixture_target(rel):
+    '''@return (str) name of relationship of the association object
+    referenced by list of references of `rel` or None (guess it)
+
+        home_matches = relationship(
+            'Match', foreign_keys='Match.home_team_id',
+            info={'fixture_target': 'away_team'})
+    '''
+    return rel.info.get(TARGET_INFO)
+
+
+def get_relationship_index(ModelBase):
+    '''get (or build) RelationshipIndex for ModelBase registry
+
+    The index is kept as an attribute of the registry, so it is
+    released together with the registry.
+    '''
+    registry = ModelBase.registry
+    index = getattr(registry, '_sqla_yaml_fixtures_rel_index', None)
+    # rebuild if mappers were added to registry after index was built
+    if index is None or index.size != len(registry.mappers):
+        index = RelationshipIndex(registry)
+        registry._sqla_yaml_fixtures_rel_index = index
+    return index
@@ -0,0 +1,192 @@
+'''long running process that loads fixtures on request
+
+The server keeps imported models (with configured mappers), engines and
+parsed fixture files between requests, so a load only pays for the
+database work. Requests and responses are a single line of JSON sent
+over a Unix socket:
+
+    {"command": "load", "db_base": "pkg.models:Base", "db_url": "...",
+     "files": ["/abs/path/fixture.yaml"]}
+
+    {"ok": true, "output": "...", "elapsed": 0.012}
+'''
+
+import os
+import json
+import stat
+import time
+import socket
+import socketserver
+
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import sqla_yaml_fixtures
+from .cmd import import_base, read_fixtures, render_jinja2
+from sqla_yaml_fixtures_client import request
+
+
+__all__ = ['FixtureServer', 'request']
+
+
+def _unchanged(mtimes):
+    '''@return True if no file in {path: mtime} was modified'''
+    try:
+        return all(os.stat(path).st_mtime_ns == mtime
+                   for path, mtime in mtimes.items())
+    except OSError:
+        return False
+
+
+def _remove_stale_socket(path):
+    '''remove socket file left by a server that is not running
+
+    Other files are never removed (bind fails).
+    @raise RuntimeError if a server is listening on the socket
+    '''
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise RuntimeError('A server is already listening on {}'.format(path))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        start = time.perf_counter()
+        try:
+            req = json.loads(self.rfile.readline())
+            output = self.server.execute(req)
+            resp = {'ok': True, 'output': output}
+        except Exception as exp:
+            resp = {'ok': False, 'error': '{}: {}'.format(
+                type(exp).__name__, exp)}
+        resp['elapsed'] = time.perf_counter() - start
+        self.wfile.write(json.dumps(resp).encode() + b'\n')
+
+
+class FixtureServer(socketserver.UnixStreamServer):
+    '''serve load/reset/validate requests, one at a time
+
+    :var bases (dict): db_base string -> Base class
+    :var engines (dict): DB URL -> Engine
+    :var fixtures (dict): (path, jinja2) -> ({path: mtime}, Fixtures),
+                          re-parsed when the file (or a file it
+                          includes) is modified
+    :var include_cache (IncludeCache): included files, parsed once
+                                       while not modified
+    '''
+
+    def __init__(self, socket_path):
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, _Handler)
+        self.socket_path = socket_path
+        self.bases = {}
+        self.engines = {}
+        self.fixtures = {}
+        self.include_cache = sqla_yaml_fixtures.IncludeCache()
+        self.running = False
+
+    def base(self, db_base):
+        if db_base not in self.bases:
+            self.bases[db_base] = import_base(db_base)
+            sqlalchemy.orm.configure_mappers()
+        return self.bases[db_base]
+
+    def engine(self, db_url):
+        if db_url not in self.engines:
+            self.engines[db_url] = create_engine(db_url)
+        return self.engines[db_url]
+
+    def parsed(self, files, jinja2=False):
+        '''@return Fixtures, only modified files are read and parsed
+
+        Files included by many files are loaded only once.
+        '''
+        sources, includes = [], {}
+        loaded = set()  # real paths of sources
+        for path in files:
+            cached = self.fixtures.get((path, jinja2))
+            if cached is None or not _unchanged(cached[0]):
+                text = read_fixtures([path], jinja2)
+                fixtures = sqla_yaml_fixtures.parse(
+                    text, include_cache=self.include_cache,
+                    render=render_jinja2 if jinja2 else None)
+                mtimes = {name: os.stat(name).st_mtime_ns
+                          for name in fixtures.files()}
+                cached = self.fixtures[(path, jinja2)] = (mtimes, fixtures)
+            includes.update(cached[1].includes)
+            for name, data in cached[1].sources:
+                real = os.path.realpath(name)
+                if real not in loaded:
+                    loaded.add(real)
+                    sources.append((name, data))
+        return sqla_yaml_fixtures.Fixtures(sources, includes)
+
+    def execute(self, req):
+        '''execute a request, @return (str) output'''
+        command = req.get('command')
+        method = getattr(self, 'cmd_' + str(command), None)
+        if method is None:
+            raise ValueError('Unknown command `{}`'.format(command))
+        return method(req)
+
+    def cmd_load(self, req):
+        BaseClass = self.base(req['db_base'])
+        if req.get('reset_db') or req.get('reset_data'):
+            self.cmd_reset(dict(req, data=req.get('reset_data')))
+        fixtures = self.parsed(req['files'], req.get('jinja2', False))
+        with Session(bind=self.engine(req['db_url'])) as session:
+            store = sqla_yaml_fixtures.load(
+                BaseClass, session, fixtures, stats=req.get('stats', False))
+        if req.get('stats'):
+            return store.stats.report()
+        return ''
+
+    def cmd_reset(self, req):
+        metadata = self.base(req['db_base']).metadata
+        engine = self.engine(req['db_url'])
+        if req.get('data'):
+            sqla_yaml_fixtures.reset_data(engine, metadata)
+        else:
+            metadata.drop_all(engine)
+            metadata.create_all(engine)
+        return ''
+
+    def cmd_validate(self, req):
+        BaseClass = self.base(req['db_base'])
+        fixtures = self.parsed(req['files'], req.get('jinja2', False))
+        if req.get('core'):
+            errors = sqla_yaml_fixtures.validate_core(
+                BaseClass.metadata, fixtures)
+        else:
+            errors = sqla_yaml_fixtures.validate(BaseClass, fixtures)
+        if errors:
+            lines = [str(error) for error in errors]
+            lines.append('{} error(s) found.'.format(len(errors)))
+            raise ValueError('\n'.join(lines))
+        return '{} file(s) OK.'.format(len(req['files']))
+
+    def cmd_shutdown(self, req):
+        self.running = False
+        return ''
+
+    def serve(self):
+        '''handle requests until a `shutdown` command is received'''
+        self.running = True
+        try:
+            while self.running:
+                self.handle_request()
+        finally:
+            self.server_close()
+            for engine in self.engines.values():
+                engine.dispose()
+            os.unlink(self.socket_path)
@@ -0,0 +1,312 @@
+'''statistics collected while loading fixtures'''
+
+import time
+import threading
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
+
+from sqlalchemy import event
+
+
+def _table_name(context, names):
+    '''@return name of table used by statement (or mapper name from
+    `names`), None if unknown'''
+    compiled = getattr(context, 'compiled', None)
+    stmt = getattr(compiled, 'statement', None)
+    table = getattr(stmt, 'table', None)  # DML
+    if table is None:
+        # SELECT, `froms` is deprecated since SQLAlchemy 1.4.23
+        get_froms = getattr(stmt, 'get_final_froms', None)
+        froms = get_froms() if get_froms else getattr(stmt, 'froms', ())
+        table = next((f for f in froms if hasattr(f, 'name')), None)
+    if table is None or not hasattr(table, 'name'):
+        return None
+    return names.get(table.name, table.name)
+
+
+class StatementBudgetExceeded(Exception):
+    '''number of SQL statements went over `max_statements`'''
+
+
+class StatementStats:
+    '''count SQL statements executed on an Engine / Connection
+
+    Every cursor execution is a round trip, an executemany counts as
+    a single round trip for all its rows. Statements can be executed
+    by many threads (partitioned loads).
+
+    :var max_statements (int): raise StatementBudgetExceeded when more
+                               statements than this are executed
+    :var names (dict): table name -> name used on report (mapper name)
+    '''
+
+    def __init__(self, max_statements=None, names=None):
+        self.max_statements = max_statements
+        self.names = names or {}
+        self.round_trips = 0
+        self.rows = 0
+        self.by_type = Counter()  # SELECT/INSERT/UPDATE/DELETE -> count
+        self.by_mapper = {}  # mapper or table name -> Counter by type
+        self._lock = threading.Lock()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        kind = statement.lstrip().split(None, 1)[0].upper()
+        name = _table_name(context, self.names)
+        with self._lock:
+            if (self.max_statements is not None
+                    and self.round_trips >= self.max_statements):
+                msg = 'Statement budget exceeded: more than {} statements.\n{}'
+                raise StatementBudgetExceeded(
+                    msg.format(self.max_statements, self.report()))
+            self.round_trips += 1
+            self.rows += len(parameters) if executemany else 1
+            self.by_type[kind] += 1
+            if name is not None:
+                self.by_mapper.setdefault(name, Counter())[kind] += 1
+
+    @contextmanager
+    def listen(self, target):
+        '''count statements executed on target (Engine or Connection)'''
+        event.listen(target, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        try:
+            yield self
+        finally:
+            event.remove(target, 'before_cursor_execute',
+                         self._before_cursor_execute)
+
+    def report(self):
+        '''@return (str) human readable counts'''
+        lines = ['SQL statements: {} round trips, {} rows'.format(
+            self.round_trips, self.rows)]
+        lines.append('  ' + ', '.join(
+            '{}: {}'.format(kind, count)
+            for kind, count in sorted(self.by_type.items())))
+        for name, counter in sorted(self.by_mapper.items()):
+            lines.append('  {}: {}'.format(name, ', '.join(
+                '{} {}'.format(kind, count)
+                for kind, count in sorted(counter.items()))))
+        return '\n'.join(lines)
+
+
+def _format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} GiB'.format(size)
+
+
+# memory usage of a phase in bytes, top is list of str (allocation sites)
+PhaseMemory = namedtuple('PhaseMemory', 'name peak retained top')
+
+
+class NullProfile:
+    '''MemoryProfile interface doing nothing, used when not profiling'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+    def mapper(self, name):
+        return nullcontext()
+
+
+class MemoryProfile:
+    '''python memory allocated on each phase of a load, using tracemalloc
+
+    `peak` is the highest memory usage during the phase,
+    `retained` is memory still allocated at the end of the phase,
+    both relative to the memory used at the start of the phase.
+
+    Used as a context manager, tracing is stopped when leaving the
+    outermost `with` block.
+
+    :var phases (list): PhaseMemory for each phase, in execution order
+    :var mappers (dict): mapper name -> PhaseMemory (top is empty)
+    :var top (int): number of allocation sites reported per phase
+    '''
+
+    def __init__(self, top=5):
+        self.top = top
+        self.phases = []
+        self.mappers = {}
+        self._started = False
+        self._depth = 0  # nested `with` blocks
+        self._peak = 0  # absolute peak of current phase
+
+    def __enter__(self):
+        self._depth += 1
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if not self._depth:
+            self.stop()
+
+    def start(self):
+        '''start tracing memory allocations (if not tracing already)'''
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+
+    def stop(self):
+        '''stop tracing, only if tracing was started by start()'''
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    @staticmethod
+    def _reset_peak():
+        # python < 3.9 peak can not be reset, it is the peak since start
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    @contextmanager
+    def phase(self, name):
+        '''measure memory allocated by code in the `with` block'''
+        self.start()
+        before = self._snapshot()
+        self._reset_peak()
+        start = self._peak = tracemalloc.get_traced_memory()[0]
+        yield
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, self._peak)
+        after = self._snapshot()
+        top = ['{}: {}'.format(stat.traceback, _format_size(stat.size_diff))
+               for stat in after.compare_to(before, 'lineno')[:self.top]]
+        self.phases.append(
+            PhaseMemory(name, peak - start, current - start, top))
+
+    @contextmanager
+    def mapper(self, name):
+        '''measure memory of a mapper, accumulated over all its entries'''
+        start, peak = tracemalloc.get_traced_memory()
+        # keep peak of enclosing phase before it is reset
+        self._peak = max(self._peak, peak)
+        self._reset_peak()
+        yield
+        current, peak = tracemalloc.get_traced_memory()
+        self._peak = max(self._peak, peak)
+        prev = self.mappers.get(name)
+        peak -= start
+        retained = current - start
+        if prev is not None:
+            peak = max(peak, prev.peak)
+            retained += prev.retained
+        self.mappers[name] = PhaseMemory(name, peak, retained, [])
+
+    def report(self):
+        '''@return (str) human readable memory usage'''
+        lines = ['Memory (peak / retained):']
+        for mem in self.phases:
+            lines.append('  {}: {} / {}'.format(
+                mem.name, _format_size(mem.peak), _format_size(mem.retained)))
+            lines.extend('    ' + site for site in mem.top)
+        for mem in self.mappers.values():
+            lines.append('  {}: {} / {}'.format(
+                mem.name, _format_size(mem.peak), _format_size(mem.retained)))
+        return '\n'.join(lines)
+
+
+# rows: number of rows processed so far, rate: rows per second,
+# mapper/source: mapper name and source (file) name of last row
+# statements: SQL statements executed while flushing (ORM)
+ProgressEvent = namedtuple(
+    'ProgressEvent', 'rows elapsed rate mapper source done statements')
+
+
+class Progress:
+    '''report progress of a load by calling `callback(ProgressEvent)`
+
+    Counting a row is just an increment and a clock read,
+    callback is called at most once every `interval` seconds
+    (and once when the load is done).
+    While the ORM session is flushed, progress is reported by counting
+    SQL statements.
+    '''
+
+    def __init__(self, callback, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self.rows = 0
+        self.statements = 0
+        self._start = self._next = None
+
+    def start(self):
+        self.rows = 0
+        self.statements = 0
+        self._start = time.monotonic()
+        self._next = self._start + self.interval
+
+    def row(self, mapper, source=None):
+        '''count one processed row'''
+        self.rows += 1
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self._emit(now, mapper, source, False)
+
+    def statement(self, mapper=None):
+        '''count one SQL statement executed while flushing'''
+        self.statements += 1
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self._emit(now, mapper, None, False)
+
+    @contextmanager
+    def listen(self, target, names=None):
+        '''count statements executed on target (Engine or Connection)
+
+        :param names: table name -> name used on events (mapper name)
+        '''
+        names = names or {}
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            self.statement(_table_name(context, names))
+        event.listen(target, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield self
+        finally:
+            event.remove(target, 'before_cursor_execute',
+                         before_cursor_execute)
+
+    def done(self, mapper=None, source=None):
+        self._emit(time.monotonic(), mapper, source, True)
+
+    def _emit(self, now, mapper, source, done):
+        elapsed = now - self._start
+        rate = self.rows / elapsed if elapsed else 0.0
+        self.callback(ProgressEvent(self.rows, elapsed, rate, mapper,
+                                    source, done, self.statements))
+
+
+class NullProgress:
+    '''Progress interface doing nothing, used when not reporting'''
+
+    def start(self):
+        pass
+
+    def row(self, mapper, source=None):
+        pass
+
+    def listen(self, target, names=None):
+        return nullcontext()
+
+    def done(self, mapper=None, source=None):
+        pass
@@ -0,0 +1,453 @@
+'''check fixtures against the schema without a database
+
+Validation does not instantiate any model, all errors are reported at once.
+'''
+
+import os
+import inspect
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+import sqlalchemy
+from sqlalchemy.orm.relationships import RelationshipProperty
+
+from .schema import from_registry, get_relationship_index, fixture_target
+from .fixtures import Fixtures, is_lookup
+from .files import FileRef, FixtureLoader, load_yaml
+from .include import IncludeCache, include_sources, is_include
+from .coerce import column_converters, coerce_block
+
+
+class FixtureError(namedtuple('FixtureError', 'source path message')):
+    '''error found in fixture
+
+    :var source (str): name of source (file) or None
+    :var path (str): location of value, i.e. `User[0].profile.name`
+    '''
+    def __str__(self):
+        return ': '.join(part for part in self if part)
+
+
+def _parse_source(source, loader):
+    '''parse one source, executed in worker process
+
+    @return (name, data, error)
+    '''
+    name, text = source
+    try:
+        data = load_yaml(text, loader, name)
+    except yaml.YAMLError as exp:
+        return name, None, 'Invalid YAML: {}'.format(exp)
+    if data is None:
+        data = []  # empty (or only comments) source
+    if not isinstance(data, list):
+        return name, None, 'Top level YAML should be sequence (list).'
+    return name, data, None
+
+
+def parse_sources(fixture_text, loader=None, workers=None, render=None):
+    '''parse sources, in parallel when more than one source
+
+    Included files are parsed (by the main process) after all sources.
+
+    :param fixture_text: YAML string or sequence of (name, YAML string),
+                         or Fixtures (already parsed)
+    :param workers: max number of worker processes (default: CPU count)
+    :param render: callable(text) -> YAML text applied to included files
+    @return (list of (name, data), list of FixtureError)
+    '''
+    if isinstance(fixture_text, Fixtures):
+        return fixture_text.sources, []
+    if loader is None:
+        loader = FixtureLoader
+    if isinstance(fixture_text, str):
+        fixture_text = [(None, fixture_text)]
+    fixture_text = list(fixture_text)
+    if len(fixture_text) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                _parse_source, fixture_text, [loader] * len(fixture_text)))
+    else:
+        results = [_parse_source(source, loader) for source in fixture_text]
+
+    sources, errors = [], []
+    for name, data, error in results:
+        if error:
+            errors.append(FixtureError(name, '', error))
+        else:
+            sources.append((name, data))
+
+    def include_error(source, path, msg):
+        errors.append(FixtureError(source, path, msg))
+    sources, _ = include_sources(sources, loader, IncludeCache(),
+                                 include_error, render)
+    return sources, errors
+
+
+class _Validator:
+    '''check references and keys, common to ORM and core'''
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.errors = []
+        self.source = None  # current source name
+        # __key__ -> mapper (or table) of all keys, defined so far
+        self.keys = {}
+        self.all_keys = set(self._collect_keys())
+
+    def _collect_keys(self):
+        for _, data in self.sources:
+            for model_entry in data:
+                if not isinstance(model_entry, dict):
+                    continue
+                for instances in model_entry.values():
+                    if not isinstance(instances, list):
+                        continue
+                    for fields in instances:
+                        if isinstance(fields, dict) and '__key__' in fields:
+                            yield fields['__key__']
+
+    def error(self, path, msg):
+        self.errors.append(FixtureError(self.source, path, msg))
+
+    def entries(self):
+        '''yield (entry name, instances) of valid entries'''
+        for source, data in self.sources:
+            self.source = source
+            for idx, model_entry in enumerate(data):
+                path = '[{}]'.format(idx)
+                if is_include(model_entry):
+                    continue  # checked while parsing
+                if not isinstance(model_entry, dict) or len(model_entry) != 1:
+                    names = (', '.join(str(k) for k in model_entry)
+                             if isinstance(model_entry, dict) else model_entry)
+                    self.error(path, 'Sequence item must contain only one'
+                               ' mapper, found: {}.'.format(names))
+                    continue
+                name, instances = next(iter(model_entry.items()))
+                if instances is None:
+                    continue
+                if not isinstance(instances, list):
+                    self.error(name, 'must contain a sequence(list).')
+                    continue
+                yield name, instances
+
+    def rows(self, name, instances):
+        '''yield (path, key, fields) of rows that are mappings
+
+        `__defaults__` are yielded as a row without key.
+        '''
+        for idx, fields in enumerate(instances):
+            path = '{}[{}]'.format(name, idx)
+            if not isinstance(fields, dict):
+                self.error(path, 'must be a mapping, found: {!r}'.format(
+                    fields))
+                continue
+            if '__defaults__' in fields:
+                path = '{}.__defaults__'.format(name)
+                defaults = fields['__defaults__']
+                if idx != 0 or len(fields) != 1:
+                    self.error(path, 'must be the only field of the first'
+                               ' item.')
+                elif not isinstance(defaults, dict):
+                    self.error(path, 'must be a mapping, found: {!r}'.format(
+                        defaults))
+                else:
+                    if '__key__' in defaults:
+                        self.error(path, '`__key__` is not allowed.')
+                    yield path, None, defaults
+                continue
+            yield path, fields.get('__key__'), fields
+
+    def file(self, path, value):
+        '''check file of a `!file` value exists'''
+        if isinstance(value, FileRef) and not os.path.isfile(value.path):
+            self.error(path, 'File not found: {}'.format(value.path))
+
+    def coerce(self, rows, converters):
+        '''check values can be converted to column types
+
+        :param rows: list of (path, fields)
+        '''
+        _, errors = coerce_block(converters, [fields for _, fields in rows])
+        for idx, key, msg in errors:
+            self.error('{}.{}'.format(rows[idx][0], key), msg)
+
+    def put_key(self, path, key, target):
+        if key in self.keys:
+            self.error(path, 'Duplicate key: {}'.format(key))
+        self.keys[key] = target
+
+    def ref(self, path, ref):
+        '''check reference is a key defined before
+
+        @return mapper/table of referenced key (None if unknown)
+        '''
+        if not isinstance(ref, str):
+            self.error(path, 'Invalid reference: {!r}'.format(ref))
+            return None
+        key = ref.split('.')[0]
+        if key in self.keys:
+            return self.keys[key]
+        if key in self.all_keys:
+            self.error(path, 'Reference `{}` is used before its definition'
+                       ' (check mapper ordering)'.format(key))
+        else:
+            self.error(path, 'Reference to undefined key `{}`'.format(key))
+        return None
+
+
+class _ORMValidator(_Validator):
+    def __init__(self, ModelBase, sources):
+        super().__init__(sources)
+        self.ModelBase = ModelBase
+        self.rel_index = get_relationship_index(ModelBase)
+        self._converters = {}  # model -> column converters
+
+    def converters(self, model):
+        '''@return column converters of model (cached)'''
+        if model not in self._converters:
+            self._converters[model] = column_converters(
+                (attr.key, attr.columns[0])
+                for attr in model.__mapper__.column_attrs)
+        return self._converters[model]
+
+    def validate(self):
+        for name, instances in self.entries():
+            model_name, _, creator = name.partition(':')
+            try:
+                model = from_registry(self.ModelBase, model_name)
+            except KeyError:
+                self.error(name, 'Unknown mapper `{}`'.format(model_name))
+                continue
+            if creator and not hasattr(model, creator):
+                self.error(name, 'Mapper `{}` has no creator `{}`'.format(
+                    model_name, creator))
+            has_creator = (bool(creator) or hasattr(model, 'from_fixture')
+                           or hasattr(model, 'from_fixture_batch'))
+            rows = []
+            nested = {}  # model -> [(path, fields)] of nested instances
+            for path, key, fields in self.rows(model_name, instances):
+                self.fields(path, model, fields, has_creator,
+                            implicit=('__key__',), nested=nested)
+                if key is not None:
+                    self.put_key(path, key, model.__mapper__)
+                rows.append((path, fields))
+            self.coerce(rows, self.converters(model))
+            for nested_model, nested_rows in nested.items():
+                self.coerce(nested_rows, self.converters(nested_model))
+        return self.errors
+
+    @staticmethod
+    def _init_params(model):
+        '''names of explicit params of a custom __init__'''
+        for cls in model.__mro__:
+            init = cls.__dict__.get('__init__')
+            if init is None:
+                continue
+            if getattr(init, '__name__', '') == '_declarative_constructor':
+                return ()
+            params = inspect.signature(init).parameters.values()
+            return {p.name for p in params
+                    if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)}
+        return ()
+
+    def lookup(self, path, lookup):
+        '''check mapper and columns of a lookup
+
+        @return mapper (None if invalid)
+        '''
+        try:
+            model = from_registry(self.ModelBase, lookup['lookup'])
+        except KeyError:
+            self.error(path, 'Unknown mapper `{}`'.format(lookup['lookup']))
+            return None
+        for col in lookup['by']:
+            if not hasattr(model, col):
+                self.error(path, 'Mapper `{}` has no field `{}`'.format(
+                    model.__name__, col))
+        return model.__mapper__
+
+    def _ref_mapper(self, path, ref):
+        '''mapper of object referenced by a (dotted) reference'''
+        mapper = self.ref(path, ref)
+        if mapper is None:
+            return None
+        for attr in ref.split('.')[1:]:
+            prop = mapper.attrs.get(attr)
+            if prop is None:
+                if not hasattr(mapper.class_, attr):
+                    self.error(path, 'Mapper `{}` has no attribute `{}`'
+                               .format(mapper.class_.__name__, attr))
+                return None
+            if not isinstance(prop, RelationshipProperty):
+                return None
+            mapper = prop.mapper
+        return mapper
+
+    def fields(self, path, model, fields, has_creator=False, implicit=(),
+               nested=None):
+        '''check fields of an instance, and of its nested instances
+
+        Nested instances are checked using a stack (no recursion).
+        :param implicit: fields set by the loader (back_populates)
+        :param nested: dict, nested instances are added as
+                       {model: [(path, fields)]} (values to be coerced)
+        '''
+        stack = [(path, model, fields, has_creator, implicit)]
+        top = True
+        while stack:
+            item = stack.pop()
+            if not top and nested is not None:
+                nested.setdefault(item[1], []).append((item[0], item[2]))
+            top = False
+            self._fields(stack, *item)
+
+    def _fields(self, stack, path, model, fields, has_creator, implicit):
+        '''check fields of one instance, nested are pushed to stack'''
+        init_params = self._init_params(model)
+        nested = []
+        for name, value in fields.items():
+            if name in implicit:
+                continue
+            field_path = '{}.{}'.format(path, name)
+            self.file(field_path, value)
+            attr = getattr(model, name, None)
+            column = getattr(attr, 'property', None)
+            if column is None:
+                if name in init_params or has_creator:
+                    if is_lookup(value):
+                        self.lookup(field_path, value)
+                    elif isinstance(value, dict):
+                        if 'ref' in value:
+                            self.ref(field_path, value['ref'])
+                        else:
+                            self.error(field_path,
+                                       'Expected `ref` in {!r}'.format(value))
+                elif not hasattr(model, name):
+                    self.error(field_path, 'Mapper `{}` has no field `{}`'
+                               .format(model.__name__, name))
+                continue
+            if not isinstance(column, RelationshipProperty):
+                continue
+            self.relationship(nested, field_path, column, value)
+        stack.extend(reversed(nested))
+
+    def _check_target(self, path, expected, mapper):
+        if mapper is not None and not mapper.isa(expected):
+            self.error(path, 'Expected reference to `{}`, found `{}`'.format(
+                expected.class_.__name__, mapper.class_.__name__))
+
+    def relationship(self, nested, path, column, value):
+        '''check relationship value, nested instances added to `nested`'''
+        rel_model = column.mapper.class_
+        implicit = (column.back_populates,) if column.back_populates else ()
+        if is_lookup(value):
+            self._check_target(path, column.mapper, self.lookup(path, value))
+        elif isinstance(value, dict):
+            nested.append((path, rel_model, value, False, implicit))
+        elif isinstance(value, str):
+            self._check_target(path, column.mapper,
+                               self._ref_mapper(path, value))
+        elif isinstance(value, list):
+            if not value:
+                return
+            if isinstance(value[0], str):
+                for idx, ref in enumerate(value):
+                    ref_path = '{}[{}]'.format(path, idx)
+                    target = self._ref_mapper(ref_path, ref)
+                    if column.secondary is not None:
+                        self._check_target(ref_path, column.mapper, target)
+                    elif target is not None:
+                        # association object
+                        try:
+                            self.rel_index.find_one(
+                                column.mapper, target,
+                                exclude=column._reverse_property,
+                                key=fixture_target(column))
+                        except Exception as exp:
+                            self.error(ref_path, str(exp))
+            else:
+                for idx, item in enumerate(value):
+                    item_path = '{}[{}]'.format(path, idx)
+                    if isinstance(item, dict):
+                        nested.append(
+                            (item_path, rel_model, item, False, implicit))
+                    else:
+                        self.error(item_path, 'Expected mapping or reference,'
+                                   ' found: {!r}'.format(item))
+
+
+class _CoreValidator(_Validator):
+    def __init__(self, metadata, sources):
+        super().__init__(sources)
+        self.tables = {table.name: table for table in metadata.sorted_tables}
+
+    def lookup(self, path, lookup):
+        '''check table and columns of a lookup'''
+        table = self.tables.get(lookup['lookup'])
+        if table is None:
+            self.error(path, 'Unknown table `{}`'.format(lookup['lookup']))
+            return
+        for col in lookup['by']:
+            if table.c.get(col) is None:
+                self.error(path, 'Inavlid column name: {}.{}'.format(
+                    table.name, col))
+
+    def validate(self):
+        for table_name, instances in self.entries():
+            table = self.tables.get(table_name)
+            if table is None:
+                self.error(table_name, 'Unknown table `{}`'.format(table_name))
+                continue
+            rows = []
+            for path, key, fields in self.rows(table_name, instances):
+                rows.append((path, fields))
+                for name, value in fields.items():
+                    if name == '__key__':
+                        continue
+                    col = table.c.get(name)
+                    field_path = '{}.{}'.format(path, name)
+                    self.file(field_path, value)
+                    if col is None:
+                        self.error(field_path, 'Inavlid column name: {}.{}'
+                                   .format(table_name, name))
+                    elif col.foreign_keys:
+                        if is_lookup(value):
+                            self.lookup(field_path, value)
+                        else:
+                            self.ref(field_path, value)
+                if key is not None:
+                    self.put_key(path, key, table)
+            self.coerce(rows, column_converters(
+                (col.key, col) for col in table.c if not col.foreign_keys))
+        return self.errors
+
+
+def validate(ModelBase, fixture_text, loader=None, workers=None,
+             render=None):
+    '''check fixtures for `load()` without touching the database
+
+    Checks mapper, column and relationship names, references
+    (defined before being used), duplicate keys.
+
+    :param fixture_text: YAML string or sequence of (name, YAML string)
+    :param workers: number of processes used to parse sources
+    :param render: callable(text) -> YAML text applied to included files
+    @return list of FixtureError (empty if valid)
+    '''
+    # make sure backref attributes are created
+    sqlalchemy.orm.configure_mappers()
+    sources, errors = parse_sources(fixture_text, loader, workers, render)
+    return errors + _ORMValidator(ModelBase, sources).validate()
+
+
+def validate_core(metadata, fixture_text, loader=None, workers=None,
+                  render=None):
+    '''check fixtures for `load_core()` without touching the database
+
+    @return list of FixtureError (empty if valid)
+    '''
+    sources, errors = parse_sources(fixture_text, loader, workers, render)
+    return errors + _CoreValidator(metadata, sources).validate()
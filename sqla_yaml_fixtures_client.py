@@ -0,0 +1,84 @@
+'''client of `sqla_yaml_fixtures serve`
+
+A top-level module (not part of the `sqla_yaml_fixtures` package) so
+that sending a request does not import SQLAlchemy, PyYAML or the
+package itself. Run it with:
+
+    $ python -m sqla_yaml_fixtures_client --socket /tmp/fixtures.sock shutdown
+'''
+
+import os
+import sys
+import json
+import socket
+import argparse
+
+
+SOCKET = '.sqla_yaml_fixtures.sock'
+
+
+def make_client_parser():
+    '''create cmd line parser for `client` sub-command'''
+    parser = argparse.ArgumentParser(
+        prog='sqla_yaml_fixtures client',
+        description='send a request to a running `serve` process',)
+    parser.add_argument(
+        '--socket', default=SOCKET,
+        help='Unix socket path (default: {})'.format(SOCKET))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help='load fixtures')
+    reset = commands.add_parser('reset', help='reset DB')
+    validate = commands.add_parser('validate', help='validate fixtures')
+    commands.add_parser('shutdown', help='stop server')
+    for cmd_parser in (load, reset, validate):
+        cmd_parser.add_argument('--db-base', required=True)
+    for cmd_parser in (load, reset):
+        cmd_parser.add_argument('--db-url', required=True)
+    for cmd_parser in (load, validate):
+        cmd_parser.add_argument('files', metavar='FILE', nargs='+')
+        cmd_parser.add_argument('--jinja2', action='store_true')
+    load_reset = load.add_mutually_exclusive_group()
+    load_reset.add_argument('--reset-db', action='store_true')
+    load_reset.add_argument('--reset-data', action='store_true')
+    load.add_argument('--stats', action='store_true')
+    reset.add_argument(
+        '--data', action='store_true',
+        help='delete data only, do not re-create schema')
+    validate.add_argument('--core', action='store_true')
+    return parser
+
+
+def request(socket_path, command, **params):
+    '''send a request to a FixtureServer
+
+    @return (dict) response with `ok`, `elapsed`, `output` or `error`
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(dict(params, command=command)).encode()
+                     + b'\n')
+        with sock.makefile('rb') as fp:
+            return json.loads(fp.readline())
+
+
+def main(argv=None):
+    '''exit with code 1 if request failed'''
+    if argv is None:
+        argv = sys.argv[1:]
+    params = vars(make_client_parser().parse_args(argv))
+    socket_path = params.pop('socket')
+    # server might be running on another directory
+    if 'files' in params:
+        params['files'] = [os.path.abspath(f) for f in params['files']]
+    resp = request(socket_path, **params)
+    if not resp['ok']:
+        print(resp['error'])
+        sys.exit(1)
+    if resp['output']:
+        print(resp['output'])
+    print('{}: {:.3f}s'.format(params['command'], resp['elapsed']))
+
+
+if __name__ == '__main__':
+    main()
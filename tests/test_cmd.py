@@ -3,6 +3,7 @@ import subprocess
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
+import pytest
 
 
 def test_sample():
@@ -47,3 +48,229 @@ def test_sample():
     assert profiles[0].user.username == 'joey'
     assert profiles[1].name == 'Douglas'
     assert profiles[1].user.username == 'deedee'
+
+
+def test_stats():
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/sample.db'.format(work_dir)
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', '--stats', 'sample/fixtures.yaml']
+    output = subprocess.check_output(cmd, cwd=work_dir).decode()
+    assert 'SQL statements' in output
+    assert 'User: INSERT' in output
+
+
+def test_memprofile():
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/sample.db'.format(work_dir)
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', '--memprofile', 'sample/fixtures.yaml']
+    output = subprocess.check_output(cmd, cwd=work_dir).decode()
+    assert 'Memory (peak / retained):' in output
+    assert 'render:' in output
+    assert 'build:' in output
+
+
+def test_memprofile_parse(tmp_path):
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/sample.db'.format(work_dir)
+    fixtures = tmp_path / 'fixtures.yaml'
+    fixtures.write_text('- User:\n' + ''.join(
+        '  - username: user{0}\n    email: user{0}@example.com\n'.format(n)
+        for n in range(2000)))
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', '--memprofile', str(fixtures)]
+    output = subprocess.check_output(cmd, cwd=work_dir).decode()
+    parse_lines = [line for line in output.splitlines()
+                   if line.startswith('  parse:')]
+    # parsed once, by the cmd, not again by load()
+    assert len(parse_lines) == 1
+    peak = parse_lines[0].split()[1:3]
+    assert peak[1] in ('KiB', 'MiB'), parse_lines[0]
+    assert float(peak[0]) > 100 or peak[1] == 'MiB', parse_lines[0]
+
+
+def test_progress():
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/sample.db'.format(work_dir)
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', '--progress', '0', 'sample/fixtures.yaml']
+    result = subprocess.run(cmd, cwd=work_dir, check=True,
+                            capture_output=True)
+    output = result.stderr.decode()
+    assert '1 rows' in output
+    assert 'User (sample/fixtures.yaml)' in output
+    assert '4 rows' in output
+
+
+def test_validate(tmp_path):
+    work_dir = os.path.dirname(__file__)
+    bad_file = tmp_path / 'bad.yaml'
+    bad_file.write_text('- User: [{username: joey, colour: blue}]')
+    cmd = ['python', '-m', 'sqla_yaml_fixtures', 'validate',
+           '--db-base', 'sample.schema:BaseModel',
+           'sample/fixtures.yaml', str(bad_file)]
+    result = subprocess.run(cmd, cwd=work_dir, capture_output=True)
+    assert result.returncode == 1
+    output = result.stdout.decode()
+    assert 'bad.yaml: User[0].colour: Mapper `User` has no field' in output
+    assert '1 error(s) found.' in output
+
+
+def test_reset_data():
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/sample.db'.format(work_dir)
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', 'sample/fixtures.yaml']
+    subprocess.check_call(cmd, cwd=work_dir)
+    # load again on existing schema, data is not duplicated
+    cmd[cmd.index('--reset-db')] = '--reset-data'
+    subprocess.check_call(cmd, cwd=work_dir)
+
+    engine = create_engine(db_url)
+    session = Session(bind=engine.connect())
+    from sample.schema import User
+    users = session.query(User).order_by(User.id).all()
+    assert [u.username for u in users] == ['joey', 'deedee']
+    assert users[0].id == 1
+
+
+def test_many_databases(tmp_path):
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/sample_{{n}}.db'.format(tmp_path)
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-count', '2',
+           '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', 'sample/fixtures.yaml']
+    output = subprocess.check_output(cmd, cwd=work_dir).decode()
+    assert 'sample_0.db: ' in output
+    assert 'sample_1.db: ' in output
+
+    from sample.schema import User
+    for n in range(2):
+        engine = create_engine('sqlite:///{}/sample_{}.db'.format(tmp_path, n))
+        with Session(engine) as session:
+            assert session.query(User).count() == 2
+        engine.dispose()
+
+    cmd.insert(-1, '--alembic-stamp')
+    result = subprocess.run(cmd, cwd=work_dir, capture_output=True)
+    assert result.returncode == 2
+    assert b'--alembic-stamp is not supported' in result.stderr
+
+
+def test_serve(tmp_path):
+    work_dir = os.path.dirname(__file__)
+    socket_path = str(tmp_path / 'server.sock')
+    db_url = 'sqlite:///{}/served.db'.format(tmp_path)
+    base = 'sample.schema:BaseModel'
+    client = ['python', '-m', 'sqla_yaml_fixtures_client',
+              '--socket', socket_path]
+    server = subprocess.Popen(
+        ['python', '-m', 'sqla_yaml_fixtures', 'serve',
+         '--socket', socket_path],
+        cwd=work_dir, stdout=subprocess.PIPE)
+    try:
+        assert server.stdout.readline().startswith(b'Listening')
+        for reset in ('--reset-db', '--reset-data'):
+            output = subprocess.check_output(
+                client + ['load', '--db-base', base, '--db-url', db_url,
+                          reset, 'sample/fixtures.yaml'],
+                cwd=work_dir).decode()
+            assert output.startswith('load: ')
+
+        result = subprocess.run(
+            client + ['validate', '--db-base', base, 'no_such_file.yaml'],
+            cwd=work_dir, capture_output=True)
+        assert result.returncode == 1
+        assert b'No such file' in result.stdout
+    finally:
+        subprocess.check_call(client + ['shutdown'], cwd=work_dir)
+        server.wait(timeout=10)
+    assert not os.path.exists(socket_path)
+
+    engine = create_engine(db_url)
+    with Session(engine) as session:
+        from sample.schema import User
+        assert session.query(User).count() == 2
+    engine.dispose()
+
+
+def test_client_imports():
+    # client does not pay for importing the package and SQLAlchemy
+    code = ('import sys, sqla_yaml_fixtures_client;'
+            'print(sorted(m for m in sys.modules if m.startswith("sq")))')
+    output = subprocess.check_output(['python', '-c', code]).decode()
+    assert output.strip() == "['sqla_yaml_fixtures_client']"
+
+
+def test_server_socket(tmp_path):
+    from sqla_yaml_fixtures.server import FixtureServer
+    socket_path = str(tmp_path / 'server.sock')
+    # not a socket, never removed
+    open(socket_path, 'w').close()
+    with pytest.raises(OSError):
+        FixtureServer(socket_path)
+    assert os.path.isfile(socket_path)
+    os.unlink(socket_path)
+
+    server = FixtureServer(socket_path)
+    try:
+        with pytest.raises(RuntimeError):
+            FixtureServer(socket_path)
+    finally:
+        server.server_close()
+    # stale socket left by a server that is not running
+    FixtureServer(socket_path).server_close()
+
+
+def test_store(tmp_path):
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/layers.db'.format(tmp_path)
+    store_file = str(tmp_path / 'store.json')
+    layer = tmp_path / 'layer.yaml'
+    layer.write_text('- Group: [{name: Misfits, members: [joey.profile]}]')
+    base = ['python', '-m', 'sqla_yaml_fixtures',
+            '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+            '--yes']
+    subprocess.check_call(
+        base + ['--reset-db', '--save-store', store_file,
+                'sample/fixtures.yaml'], cwd=work_dir)
+    subprocess.check_call(
+        base + ['--seed-store', store_file, str(layer)], cwd=work_dir)
+
+    engine = create_engine(db_url)
+    with Session(engine) as session:
+        from sample.schema import Group
+        group = session.query(Group).filter_by(name='Misfits').one()
+        assert group.members[0].profile.user.username == 'joey'
+    engine.dispose()
+
+
+def test_include_cache(tmp_path):
+    work_dir = os.path.dirname(__file__)
+    db_url = 'sqlite:///{}/include.db'.format(tmp_path)
+    cache_file = tmp_path / 'include.cache'
+    fixture = tmp_path / 'misfits.yaml'
+    fixture.write_text(
+        '- __include__: {}/sample/fixtures.yaml\n'
+        '- Group: [{{name: Misfits, members: [joey.profile]}}]\n'.format(
+            work_dir))
+    cmd = ['python', '-m', 'sqla_yaml_fixtures',
+           '--db-url', db_url, '--db-base', 'sample.schema:BaseModel',
+           '--yes', '--reset-db', '--include-cache', str(cache_file),
+           str(fixture)]
+    subprocess.check_call(cmd, cwd=work_dir)
+    assert cache_file.exists()
+    subprocess.check_call(cmd, cwd=work_dir)
+
+    engine = create_engine(db_url)
+    with Session(engine) as session:
+        from sample.schema import Group
+        assert session.query(Group).count() == 2
+    engine.dispose()
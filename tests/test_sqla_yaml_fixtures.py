@@ -1,5 +1,19 @@
+import os
+import gc
+import json
+import asyncio
+import weakref
+import datetime
+import decimal
+import enum
+import tracemalloc
+
+import sqlalchemy
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import Column, Integer, String, ForeignKey, Table
+from sqlalchemy import Text, LargeBinary, Date, DateTime, Numeric, Enum
+from sqlalchemy import JSON
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import relationship, backref
@@ -52,6 +66,17 @@ user_instruments = Table(
 )
 
 
+# column with more than one FK, never set by fixtures
+Table(
+    'tag',
+    BaseModel.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(50)),
+    Column('owner_id', Integer, ForeignKey('user.id'),
+           ForeignKey('instrument.id')),
+)
+
+
 class Instrument(BaseModel):
     __tablename__ = 'instrument'
     id = Column(Integer, primary_key=True)
@@ -216,6 +241,36 @@ def session(engine, tables):
     connection.close()
 
 
+# SQLite INSERT ... RETURNING (used by `load_core()`) requires SQLAlchemy 2.0
+sqlite_returning = pytest.mark.skipif(
+    sqlalchemy.__version__.startswith('1.'),
+    reason='SQLite RETURNING not supported by SQLAlchemy < 2.0')
+
+
+def load_core(fixture, existing=None, **kwargs):
+    '''load fixture with `load_core()` into a new in-memory DB
+
+    :param existing: {table_name: [rows]} inserted before fixtures
+    @return (store, {table_name: [rows]})
+    '''
+    async def _load():
+        engine = create_async_engine('sqlite+aiosqlite://')
+        async with engine.begin() as conn:
+            await conn.run_sync(BaseModel.metadata.create_all)
+            for table_name, table_rows in (existing or {}).items():
+                table = BaseModel.metadata.tables[table_name]
+                await conn.execute(table.insert(), table_rows)
+            store = await sqla_yaml_fixtures.load_core(
+                BaseModel.metadata, conn, fixture, **kwargs)
+            rows = {}
+            for table in BaseModel.metadata.sorted_tables:
+                result = await conn.execute(table.select())
+                rows[table.name] = result.fetchall()
+        await engine.dispose()
+        return store, rows
+    return asyncio.run(_load())
+
+
 ####################################################
 # tests
 
@@ -242,6 +297,39 @@ class TestStore:
         store.put('foo', Foo)
         assert store.get('foo.bar.__class__.__name__') == 'int'
 
+    def test_get_many(self):
+        class Foo:
+            bar = 52
+        store = sqla_yaml_fixtures.Store()
+        store.put('foo', Foo)
+        store.put('x', 'X')
+        values = store.get_many(['foo.bar.__class__.__name__', 'x'])
+        assert values == ['int', 'X']
+
+    def test_get_many_batch_load(self, engine, session):
+        names = ['joey', 'dee', 'johnny']
+        store = sqla_yaml_fixtures.Store()
+        for name in names:
+            user = User(username=name, profile=Profile(name=name.upper()))
+            session.add(user)
+            store.put(name, user)
+        session.flush()
+        session.expire_all()
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            profiles = store.get_many(
+                ['{}.profile'.format(name) for name in names])
+        finally:
+            sqlalchemy.event.remove(engine, 'before_cursor_execute', count)
+        assert [p.name for p in profiles] == ['JOEY', 'DEE', 'JOHNNY']
+        # one query for users + one for profiles (instead of 3 * 2)
+        assert len(statements) == 2
+        assert store.lazy_loads_avoided == 2
+
 
 def test_insert_simple(session):
     fixture = """
@@ -415,6 +503,30 @@ def test_2many(session):
     assert groups[0].members[0].profile.groups[0].group.name == 'Ramones'
 
 
+def test_2many_bulk(session):
+    fixture = """
+- User:
+  - __key__: joey
+    username: joey
+    profile:
+      name: Jeffrey
+  - __key__: dee
+    username: deedee
+    profile:
+      name: Douglas
+
+- Group:
+  - name: Ramones
+    members: [joey.profile, dee.profile]
+"""
+    sqla_yaml_fixtures.load(BaseModel, session, fixture, bulk_many=True)
+    groups = session.query(Group).all()
+    assert len(groups) == 1
+    members = sorted(m.profile.name for m in groups[0].members)
+    assert members == ['Douglas', 'Jeffrey']
+    assert session.query(GroupMember).count() == 2
+
+
 def test_2many_secondary(session):
     fixture = """
 - Instrument:
@@ -438,6 +550,31 @@ def test_2many_secondary(session):
     assert users[0].instruments[1].name == 'guitar'
 
 
+def test_2many_secondary_bulk(session):
+    fixture = """
+- Instrument:
+  - __key__: drums
+    name: drums
+  - __key__: guitar
+    name: guitar
+
+- User:
+  - __key__: joey
+    username: joey
+    instruments: [drums, guitar]
+  - __key__: tommy
+    username: tommy
+    instruments: [drums]
+    friends: [joey]
+"""
+    sqla_yaml_fixtures.load(BaseModel, session, fixture, bulk_many=True)
+    users = session.query(User).order_by(User.username).all()
+    assert [i.name for i in users[0].instruments] == ['drums', 'guitar']
+    assert [i.name for i in users[1].instruments] == ['drums']
+    assert len(users[0].friends) == 0
+    assert [f.username for f in users[1].friends] == ['joey']
+
+
 def test_self_referencing_2many_secondary(session):
     fixture = """
 - User:
@@ -603,3 +740,1490 @@ def test_custom_loader(session):
     assert users[0].email == 'deedee@ramones.org'
     assert users[1].username == 'joey'
     assert users[1].email == 'joey@ramones.org'
+
+
+
+class Account(BaseModel):
+    __tablename__ = 'account'
+    id = Column(Integer, primary_key=True)
+    login = Column(String(150), nullable=False, unique=True)
+    password = Column(String(150))
+    person_id = Column(ForeignKey('person.id'))
+    person = relationship('Person')
+    batches = []  # number of rows of each from_fixture_batch() call
+
+    @classmethod
+    def from_fixture_batch(cls, session, values_list):
+        cls.batches.append(len(values_list))
+        # expensive setup done once per block
+        salt = '$salt$'
+        return [cls(login=values['login'], person=values.get('person'),
+                    password=salt + values.get('password', ''))
+                for values in values_list]
+
+
+def test_batch_creator(session):
+    fixture = """
+- 'Person:create':
+  - __key__: joey
+    username: joey
+- Account:
+  - __key__: joey_account
+    login: joey
+    password: gabba
+    person: joey
+  - login: dee
+"""
+    Account.batches.clear()
+    store = sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    assert Account.batches == [2]
+    account = store.get('joey_account')
+    assert account.password == '$salt$gabba'
+    assert account.person.username == 'joey'
+    assert session.query(Account).count() == 2
+
+
+def test_batch_creator_count(session, monkeypatch):
+    fixture = """
+- Account:
+  - login: joey
+"""
+    monkeypatch.setattr(Account, 'from_fixture_batch',
+                        classmethod(lambda cls, session, values_list: []))
+    with pytest.raises(Exception) as exc_info:
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    assert 'returned 0 objects, expected 1' in str(exc_info)
+
+
+### test association object relationships
+
+class Musician(BaseModel):
+    __tablename__ = 'musician'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(150), nullable=False)
+    mentees = relationship(
+        'Mentorship', foreign_keys='Mentorship.mentor_id',
+        back_populates='mentor')
+
+
+class Mentorship(BaseModel):
+    '''self-referential association object'''
+    __tablename__ = 'mentorship'
+    mentor_id = Column(ForeignKey('musician.id'), primary_key=True)
+    mentee_id = Column(ForeignKey('musician.id'), primary_key=True)
+    mentor = relationship(
+        'Musician', foreign_keys=[mentor_id], back_populates='mentees')
+    mentee = relationship('Musician', foreign_keys=[mentee_id])
+
+
+class Team(BaseModel):
+    __tablename__ = 'team'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(150), nullable=False)
+    # no back_populates, association relationship chosen explicitly
+    home_matches = relationship(
+        'Match', foreign_keys='Match.home_team_id',
+        info={'fixture_target': 'away_team'})
+
+
+class Match(BaseModel):
+    '''association object with two relationships to same target'''
+    __tablename__ = 'match'
+    home_team_id = Column(ForeignKey('team.id'), primary_key=True)
+    away_team_id = Column(ForeignKey('team.id'), primary_key=True)
+    home_team = relationship('Team', foreign_keys=[home_team_id],
+                             overlaps='home_matches')
+    away_team = relationship('Team', foreign_keys=[away_team_id])
+
+
+class TestRelationshipIndex:
+    def test_find(self):
+        sqlalchemy.orm.configure_mappers()
+        index = sqla_yaml_fixtures.get_relationship_index(BaseModel)
+        rels = index.find(GroupMember.__mapper__, Profile.__mapper__)
+        assert [rel.key for rel in rels] == ['profile']
+
+    def test_cached_per_registry(self):
+        index = sqla_yaml_fixtures.get_relationship_index(BaseModel)
+        assert index is sqla_yaml_fixtures.get_relationship_index(BaseModel)
+
+    def test_find_one_no_relationship(self):
+        index = sqla_yaml_fixtures.get_relationship_index(BaseModel)
+        with pytest.raises(Exception) as exc_info:
+            index.find_one(Genre.__mapper__, Profile.__mapper__)
+        assert 'has no field with relationship' in str(exc_info)
+
+    def test_find_one_ambiguous(self):
+        sqlalchemy.orm.configure_mappers()
+        index = sqla_yaml_fixtures.get_relationship_index(BaseModel)
+        with pytest.raises(Exception) as exc_info:
+            index.find_one(Mentorship.__mapper__, Musician.__mapper__)
+        assert 'mentee, mentor' in str(exc_info)
+        assert "info={\"fixture_target\": <name>}" in str(exc_info.value)
+
+    def test_find_one_key(self):
+        sqlalchemy.orm.configure_mappers()
+        index = sqla_yaml_fixtures.get_relationship_index(BaseModel)
+        rel = index.find_one(Match.__mapper__, Team.__mapper__,
+                             key='home_team')
+        assert rel.key == 'home_team'
+        with pytest.raises(Exception) as exc_info:
+            index.find_one(Match.__mapper__, Team.__mapper__, key='nope')
+        assert 'has no relationship `nope` to type `Team`' in str(exc_info)
+
+    def test_released_with_registry(self):
+        Base = declarative_base()
+
+        class Parent(Base):
+            __tablename__ = 'parent'
+            id = Column(Integer, primary_key=True)
+            children = relationship('Child')
+
+        class Child(Base):
+            __tablename__ = 'child'
+            id = Column(Integer, primary_key=True)
+            parent_id = Column(ForeignKey('parent.id'))
+
+        sqlalchemy.orm.configure_mappers()
+        sqla_yaml_fixtures.get_relationship_index(Base)
+        ref = weakref.ref(Base.registry)
+        del Base, Parent, Child
+        gc.collect()
+        assert ref() is None
+
+
+def test_2many_self_referential_association(session):
+    fixture = """
+- Musician:
+  - __key__: joey
+    name: joey
+  - __key__: johnny
+    name: johnny
+  - __key__: phil
+    name: phil
+    mentees: [joey, johnny]
+"""
+    sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    phil = session.query(Musician).filter_by(name='phil').one()
+    assert sorted(m.mentee.name for m in phil.mentees) == ['joey', 'johnny']
+
+
+def test_2many_self_referential_association_bulk(session):
+    fixture = """
+- Musician:
+  - __key__: joey
+    name: joey
+  - __key__: phil
+    name: phil
+    mentees: [joey]
+"""
+    store = sqla_yaml_fixtures.load(BaseModel, session, fixture,
+                                    bulk_many=True)
+    mentorship = session.query(Mentorship).one()
+    assert mentorship.mentor_id == store.get('phil').id
+    assert mentorship.mentee_id == store.get('joey').id
+
+
+@pytest.mark.parametrize('bulk_many', [False, True])
+def test_2many_association_fixture_target(session, bulk_many):
+    fixture = """
+- Team:
+  - __key__: ramones
+    name: Ramones
+  - __key__: clash
+    name: The Clash
+  - name: Blondie
+    home_matches: [ramones, clash]
+"""
+    assert sqla_yaml_fixtures.validate(BaseModel, fixture) == []
+    sqla_yaml_fixtures.load(BaseModel, session, fixture, bulk_many=bulk_many)
+    blondie = session.query(Team).filter_by(name='Blondie').one()
+    session.expire_all()
+    assert sorted(m.away_team.name for m in blondie.home_matches) == [
+        'Ramones', 'The Clash']
+    assert {m.home_team for m in blondie.home_matches} == {blondie}
+
+
+### test load_core
+
+@sqlite_returning
+def test_core_insert():
+    fixture = """
+- user:
+  - __key__: joey
+    username: joey
+- profile:
+  - user_id: joey
+    name: Jeffrey
+"""
+    store, rows = load_core(fixture)
+    assert [u.username for u in rows['user']] == ['joey']
+    assert rows['profile'][0].user_id == store.get('joey').id
+
+
+@sqlite_returning
+def test_core_column_sets():
+    fixture = """
+- user:
+  - __key__: joey
+    username: joey
+  - username: dee
+    email: dee@example.com
+  - username: johnny
+"""
+    store, rows = load_core(fixture)
+    users = rows['user']
+    assert [u.username for u in users] == ['joey', 'dee', 'johnny']
+    assert [u.email for u in users] == [None, 'dee@example.com', None]
+
+
+def test_core_invalid_column():
+    fixture = """
+- user:
+  - username: joey
+    color_no: blue
+"""
+    with pytest.raises(Exception) as exc_info:
+        load_core(fixture)
+    assert 'Inavlid column name: user.color_no' in str(exc_info)
+
+
+### test statement stats
+
+def test_stats(session):
+    fixture = """
+- User:
+  - __key__: joey
+    username: joey
+  - __key__: dee
+    username: deedee
+- Profile:
+  - user: dee
+    name: Douglas
+"""
+    store = sqla_yaml_fixtures.load(BaseModel, session, fixture, stats=True)
+    stats = store.stats
+    assert stats.by_mapper['User']['INSERT'] >= 1
+    assert stats.by_mapper['Profile']['INSERT'] == 1
+    assert stats.round_trips == sum(stats.by_type.values())
+    assert 'SQL statements' in stats.report()
+
+
+@pytest.mark.parametrize('options', [
+    {}, {'stats': True, 'progress': lambda event: None, 'partition': 2}])
+def test_session_binds(options):
+    # session without a default bind
+    engine = create_engine('sqlite://')
+    BaseModel.metadata.create_all(engine)
+    fixture = """
+- User:
+  - __key__: joey
+    username: joey
+    instruments: [{name: drums}]
+- Profile:
+  - user: joey
+    name: Jeffrey
+"""
+    with Session(binds={BaseModel: engine}) as session:
+        store = sqla_yaml_fixtures.load(BaseModel, session, fixture,
+                                        bulk_many=True, **options)
+        assert session.query(Profile).one().user.username == 'joey'
+    if options:
+        assert store.stats.by_mapper['Profile']['INSERT'] == 1
+    engine.dispose()
+
+
+def test_no_stats(session):
+    fixture = """
+- User:
+  - username: joey
+"""
+    store = sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    assert store.stats is None
+
+
+def test_max_statements():
+    fixture = """
+- User:
+  - username: joey
+  - username: dee
+    profile:
+      name: Douglas
+"""
+    # budget is exceeded in the middle of the flush, use an engine
+    # not shared with other tests
+    engine = create_engine('sqlite://')
+    BaseModel.metadata.create_all(engine)
+    with Session(bind=engine) as session:
+        with pytest.raises(sqla_yaml_fixtures.StatementBudgetExceeded):
+            sqla_yaml_fixtures.load(
+                BaseModel, session, fixture, max_statements=1)
+    engine.dispose()
+
+
+@sqlite_returning
+def test_core_stats():
+    fixture = """
+- user:
+  - __key__: joey
+    username: joey
+  - username: dee
+"""
+    store, _ = load_core(fixture, stats=True)
+    assert store.stats.by_type['INSERT'] == 2
+    assert store.stats.by_mapper['user']['INSERT'] == 2
+
+
+### test memory profile
+
+def test_memprofile(session):
+    fixture = """
+- User:
+  - username: joey
+    profile:
+      name: Jeffrey
+- Group:
+  - name: Ramones
+"""
+    store = sqla_yaml_fixtures.load(BaseModel, session, fixture,
+                                    memprofile=True)
+    memory = store.memory
+    assert [phase.name for phase in memory.phases] == [
+        'parse', 'build', 'flush']
+    assert list(memory.mappers) == ['User', 'Group']
+    assert memory.phases[0].peak > 0
+    assert 'User:' in memory.report()
+    assert not tracemalloc.is_tracing()
+
+
+@sqlite_returning
+def test_core_memprofile():
+    fixture = """
+- user:
+  - username: joey
+"""
+    store, _ = load_core(fixture, memprofile=True)
+    assert [phase.name for phase in store.memory.phases] == [
+        'parse', 'insert']
+    assert list(store.memory.mappers) == ['user']
+
+
+### test progress
+
+def test_progress(session):
+    fixture = """
+- User:
+  - username: joey
+  - username: dee
+- Group:
+  - name: Ramones
+"""
+    events = []
+    progress = sqla_yaml_fixtures.Progress(events.append, interval=0)
+    sqla_yaml_fixtures.load(BaseModel, session, fixture, progress=progress)
+    building = [e for e in events if not e.statements]
+    assert [e.rows for e in building] == [1, 2, 3]
+    assert [e.mapper for e in building] == ['User', 'User', 'Group']
+    # INSERTs executed by the flush are reported
+    flushing = [e for e in events if e.statements and not e.done]
+    assert [e.statements for e in flushing] == [1, 2, 3]
+    assert {e.mapper for e in flushing} == {'User', 'Group'}
+    assert events[-1].done
+    assert events[-1].statements == 3
+
+
+def test_progress_callback(session):
+    events = []
+    sqla_yaml_fixtures.load(BaseModel, session, "- User: [{username: joey}]",
+                            progress=events.append)
+    # only final event, interval not reached
+    assert len(events) == 1
+    assert events[0].done
+    assert events[0].rows == 1
+
+
+def test_multiple_sources(session):
+    sources = [
+        ('users.yaml', "- User: [{__key__: joey, username: joey}]"),
+        ('profiles.yaml', "- Profile: [{user: joey, name: Jeffrey}]"),
+    ]
+    events = []
+    progress = sqla_yaml_fixtures.Progress(events.append, interval=0)
+    sqla_yaml_fixtures.load(BaseModel, session, sources, progress=progress)
+    users = session.query(User).all()
+    assert users[0].profile.name == 'Jeffrey'
+    assert [e.source for e in events[:2]] == ['users.yaml', 'profiles.yaml']
+
+
+@sqlite_returning
+def test_empty_source(session):
+    sources = [
+        ('users.yaml', "- User: [{username: joey}]"),
+        ('empty.yaml', "# nothing here yet\n"),
+    ]
+    fixtures = sqla_yaml_fixtures.parse(sources)
+    assert fixtures.sources[1] == ('empty.yaml', [])
+    sqla_yaml_fixtures.load(BaseModel, session, fixtures)
+    assert session.query(User).count() == 1
+
+
+@sqlite_returning
+def test_core_progress():
+    events = []
+    load_core("- user: [{username: joey}]", progress=events.append)
+    assert events[-1].rows == 1
+
+
+### test validate
+
+class TestValidate:
+    def test_valid(self):
+        fixture = """
+- User:
+  - __key__: joey
+    username: joey
+    profile:
+      nickname: Joey
+- Profile:
+  - the_user: {ref: joey}
+    name: Jeffrey
+- Group:
+  - name: Ramones
+    members: [joey.profile]
+    genres:
+      - name: punk
+- 'Person:create':
+  - username: deedee
+"""
+        assert sqla_yaml_fixtures.validate(BaseModel, fixture) == []
+
+    def test_all_errors_reported(self):
+        fixture = """
+- User:
+  - __key__: joey
+    username: joey
+    color_no: blue
+    profile:
+      foo: 1
+- Group:
+  - name: Ramones
+    members: [joey]
+- Nope:
+  - name: x
+"""
+        errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+        assert [e.path for e in errors] == [
+            'User[0].color_no', 'User[0].profile.foo',
+            'Group[0].members[0]', 'Nope']
+        assert 'has no field `color_no`' in str(errors[0])
+        assert 'no field with relationship to type `User`' in str(errors[2])
+
+    def test_references(self):
+        fixture = """
+- Profile:
+  - user: joey
+    name: Jeffrey
+  - user: dee
+    name: Douglas
+- User:
+  - __key__: joey
+    username: joey
+  - __key__: joey
+    username: joey2
+"""
+        errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+        assert [str(e) for e in errors] == [
+            'Profile[0].user: Reference `joey` is used before its definition'
+            ' (check mapper ordering)',
+            'Profile[1].user: Reference to undefined key `dee`',
+            'User[1]: Duplicate key: joey',
+        ]
+
+    def test_sources(self):
+        sources = [
+            ('users.yaml', "- User: [{__key__: joey, username: joey}]"),
+            ('profiles.yaml', "- Profile: [{user: joey, nme: Jeffrey}]"),
+            ('broken.yaml', "- User: ["),
+        ]
+        errors = sqla_yaml_fixtures.validate(BaseModel, sources, workers=2)
+        assert [e.source for e in errors] == ['broken.yaml', 'profiles.yaml']
+        assert 'Invalid YAML' in errors[0].message
+
+    def test_core(self):
+        fixture = """
+- user:
+  - __key__: joey
+    username: joey
+- profile:
+  - user_id: dee
+    nme: Jeffrey
+- nope:
+  - x: 1
+"""
+        errors = sqla_yaml_fixtures.validate_core(BaseModel.metadata, fixture)
+        assert [e.path for e in errors] == [
+            'profile[0].user_id', 'profile[0].nme', 'nope']
+
+
+### test lookup of existing rows
+
+def test_lookup(engine, session):
+    session.add_all([User(username='joey'), User(username='dee')])
+    session.add(Instrument(name='bass'))
+    session.flush()
+    fixture = """
+- Profile:
+  - user: {lookup: User, by: {username: joey}}
+    name: Jeffrey
+  - the_user: {lookup: User, by: {username: dee}}
+    name: Douglas
+"""
+    statements = []
+    def count(conn, cursor, statement, *args):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+    try:
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', count)
+    profiles = session.query(Profile).order_by(Profile.name).all()
+    assert profiles[0].user.username == 'dee'
+    assert profiles[1].user.username == 'joey'
+    # single query for both users
+    assert len([s for s in statements if 'FROM user' in s]) == 1
+
+
+def test_lookup_chunks(session, monkeypatch):
+    monkeypatch.setattr(sqla_yaml_fixtures, 'MAX_IN_VALUES', 1)
+    session.add_all([User(username='joey'), User(username='dee')])
+    session.flush()
+    fixture = """
+- Profile:
+  - user: {lookup: User, by: {username: joey}}
+    name: Jeffrey
+  - user: {lookup: User, by: {username: dee}}
+    name: Douglas
+"""
+    sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    profiles = session.query(Profile).order_by(Profile.name).all()
+    assert [p.user.username for p in profiles] == ['dee', 'joey']
+
+
+def test_lookup_json_column(session):
+    fixture = """
+- Event:
+  - name: a
+    details: {lookup: User, by: {username: nobody}}
+"""
+    sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    event = session.query(Event).one()
+    assert event.details == {'lookup': 'User', 'by': {'username': 'nobody'}}
+
+
+def test_lookup_not_found(session):
+    fixture = """
+- Profile:
+  - user: {lookup: User, by: {username: nobody}}
+    name: Jeffrey
+"""
+    with pytest.raises(Exception) as exc_info:
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+    assert 'Lookup `User` not found' in str(exc_info)
+
+
+@sqlite_returning
+def test_core_multiple_fk_column():
+    store, rows = load_core("- tag: [{name: punk}]")
+    assert rows['tag'][0].name == 'punk'
+    fixture = """
+- user: [{__key__: joey, username: joey}]
+- tag: [{name: punk, owner_id: joey}]
+"""
+    with pytest.raises(Exception) as exc_info:
+        load_core(fixture)
+    assert 'tag.owner_id has more than one foreign key' in str(exc_info.value)
+
+
+@sqlite_returning
+def test_core_lookup():
+    fixture = """
+- profile:
+  - user_id: {lookup: user, by: {username: joey}}
+    name: Jeffrey
+"""
+    existing = {'user': [{'id': 7, 'username': 'joey'}]}
+    _, rows = load_core(fixture, existing)
+    assert rows['profile'][0].user_id == 7
+
+
+@sqlite_returning
+def test_core_lookup_json_column():
+    fixture = """
+- event:
+  - name: a
+    details: {lookup: user, by: {username: nobody}}
+"""
+    _, rows = load_core(fixture)
+    assert rows['event'][0].details['lookup'] == 'user'
+
+
+@sqlite_returning
+def test_core_lookup_not_found():
+    fixture = """
+- user:
+  - username: joey
+- profile:
+  - user_id: {lookup: user, by: {username: joey}}
+    name: Jeffrey
+"""
+    # lookup is resolved before rows are inserted
+    with pytest.raises(Exception) as exc_info:
+        load_core(fixture)
+    assert 'Lookup `user` not found' in str(exc_info)
+
+
+def test_validate_lookup():
+    fixture = """
+- Profile:
+  - user: {lookup: User, by: {username: joey}}
+    name: Jeffrey
+  - user: {lookup: Group, by: {name: Ramones}}
+    name: Douglas
+  - user: {lookup: User, by: {nick: dee}}
+    name: Douglas
+"""
+    errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+    assert [e.path for e in errors] == ['Profile[1].user', 'Profile[2].user']
+
+
+class TestResetData:
+    fixture = """
+- User:
+  - __key__: joey
+    username: joey
+    email: joey@example.com
+- Profile:
+  - user: joey
+    name: Jeffrey
+- Group:
+  - name: Ramones
+    members: [joey.profile]
+"""
+
+    def test_delete_levels(self):
+        from sqla_yaml_fixtures.reset import _delete_levels
+        levels = _delete_levels(BaseModel.metadata)
+        level_of = {table.name: idx for idx, level in enumerate(levels)
+                    for table in level}
+        for table in BaseModel.metadata.sorted_tables:
+            for fk in table.foreign_keys:
+                if fk.column.table is not table:
+                    assert level_of[table.name] < level_of[fk.column.table.name]
+
+    @pytest.mark.parametrize('dialect', ['sqlite', 'generic'])
+    def test_reset(self, tmp_path, monkeypatch, dialect):
+        engine = create_engine('sqlite:///{}'.format(tmp_path / 'reset.db'))
+        BaseModel.metadata.create_all(engine)
+        if dialect == 'generic':
+            monkeypatch.setattr(engine.dialect, 'name', 'generic')
+        for _ in range(2):
+            with Session(engine) as session:
+                sqla_yaml_fixtures.load(BaseModel, session, self.fixture)
+            sqla_yaml_fixtures.reset_data(engine, BaseModel.metadata, 2)
+            with engine.connect() as conn:
+                for table in BaseModel.metadata.sorted_tables:
+                    count = conn.execute(sqlalchemy.select(
+                        sqlalchemy.func.count()).select_from(table)).scalar()
+                    assert count == 0, table.name
+        engine.dispose()
+
+    def test_postgresql_no_cascade(self, monkeypatch):
+        from sqla_yaml_fixtures import reset
+        executed = []
+        monkeypatch.setattr(reset, '_execute',
+                            lambda engine, stmts: executed.extend(stmts))
+        reset._reset_postgresql(None, ['a', 'b'], str)
+        assert [str(stmt) for stmt in executed] == [
+            'TRUNCATE TABLE a, b RESTART IDENTITY']
+
+
+class TestLoadMany:
+    fixture = """
+- User:
+  - __key__: joey
+    username: joey
+    email: joey@example.com
+    profile:
+      name: Jeffrey
+- Group:
+  - name: Ramones
+    members: [joey.profile]
+"""
+
+    def test_parse_once(self, session):
+        fixtures = sqla_yaml_fixtures.parse(self.fixture)
+        before = repr(fixtures.sources)
+        store = sqla_yaml_fixtures.load(BaseModel, session, fixtures)
+        assert store.get('joey').profile.name == 'Jeffrey'
+        # parsed data is not modified
+        assert repr(fixtures.sources) == before
+
+    def test_load_many(self, tmp_path):
+        engines = [create_engine('sqlite:///{}'.format(tmp_path / name))
+                   for name in ('a.db', 'b.db', 'c.db')]
+        for engine in engines:
+            BaseModel.metadata.create_all(engine)
+        results = sqla_yaml_fixtures.load_many(
+            BaseModel, engines, self.fixture, stats=True)
+        assert [r.target for r in results] == engines
+        for result in results:
+            assert result.elapsed > 0
+            assert result.store.stats.round_trips > 0
+            with Session(result.target) as session:
+                group = session.query(Group).one()
+                assert group.members[0].profile.user.username == 'joey'
+            result.target.dispose()
+
+
+class TestSavedStore:
+    layer1 = """
+- User:
+  - __key__: joey
+    username: joey
+    email: joey@example.com
+    profile:
+      name: Jeffrey
+  - __key__: dee
+    username: deedee
+    email: deedee@example.com
+  - __key__: johnny
+    username: johnny
+"""
+    layer2 = """
+- Role:
+  - name: singer
+    user: joey
+  - name: bass
+    user: dee
+- Group:
+  - name: Ramones
+    members: [joey.profile]
+"""
+
+    def test_orm(self, session, tmp_path):
+        path = str(tmp_path / 'store.json')
+        sqla_yaml_fixtures.load(BaseModel, session, self.layer1).save(path)
+        session.expunge_all()
+
+        store = sqla_yaml_fixtures.Store.from_file(path)
+        store = sqla_yaml_fixtures.load(BaseModel, session, self.layer2,
+                                        store=store, stats=True)
+        # joey and dee fetched in a single query
+        assert store.stats.by_mapper['User']['SELECT'] == 1
+        assert store.get('joey').roles[0].name == 'singer'
+        assert store.get('dee').username == 'deedee'
+
+        # layer keys and keys not fetched (johnny) are saved
+        store.save(path)
+        with open(path) as fp:
+            assert set(json.load(fp)) == {'joey', 'dee', 'johnny'}
+
+    def test_only_references_fetched(self, session, tmp_path):
+        path = str(tmp_path / 'store.json')
+        sqla_yaml_fixtures.load(BaseModel, session, self.layer1).save(path)
+        with open(path) as fp:
+            saved = json.load(fp)
+        # `singer`, `bass` and `Ramones` are not in reference positions
+        saved.update({'singer': ['User', [999]], 'bass': ['User', [998]],
+                      'Ramones': ['Group', [999]]})
+        with open(path, 'w') as fp:
+            json.dump(saved, fp)
+        store = sqla_yaml_fixtures.Store.from_file(path)
+        store = sqla_yaml_fixtures.load(BaseModel, session, self.layer2,
+                                        store=store)
+        assert store.get('joey').roles[0].name == 'singer'
+
+    def test_duplicate(self, tmp_path):
+        path = tmp_path / 'store.json'
+        path.write_text('{"joey": ["User", [1]]}')
+        store = sqla_yaml_fixtures.Store.from_file(str(path))
+        with pytest.raises(AssertionError):
+            store.put('joey', object())
+
+    def test_not_found(self, session, tmp_path):
+        path = tmp_path / 'store.json'
+        path.write_text('{"joey": ["User", [999]]}')
+        store = sqla_yaml_fixtures.Store.from_file(str(path))
+        with pytest.raises(Exception) as exc_info:
+            sqla_yaml_fixtures.load(BaseModel, session,
+                                    '- Role: [{name: x, user: joey}]',
+                                    store=store)
+        assert 'Saved key `joey` not found: User (999,)' in str(exc_info)
+
+    @sqlite_returning
+    def test_core(self, tmp_path):
+        path = tmp_path / 'store.json'
+        path.write_text('{"joey": ["user", [7]], "dee": ["user", [8]]}')
+        store = sqla_yaml_fixtures.Store.from_file(str(path))
+        fixture = """
+- profile:
+  - __key__: joey_profile
+    user_id: joey
+    name: Jeffrey
+"""
+        existing = {'user': [{'id': 7, 'username': 'joey'}]}
+        store, rows = load_core(fixture, existing, store=store)
+        assert rows['profile'][0].user_id == 7
+        store.save(str(path))
+        saved = json.loads(path.read_text())
+        assert saved['joey_profile'] == ['profile', [1]]
+        assert saved['dee'] == ['user', [8]]
+        # fetched keys are saved too
+        assert saved['joey'] == ['user', [7]]
+
+    @sqlite_returning
+    def test_core_layers(self, tmp_path):
+        path = str(tmp_path / 'store.json')
+        layers = [
+            '- user: [{__key__: joey, username: joey}]',
+            '- role: [{__key__: r1, name: singer, user_id: joey}]',
+            '- role: [{__key__: r2, name: bass, user_id: joey}]',
+        ]
+
+        async def _load():
+            engine = create_async_engine('sqlite+aiosqlite:///{}'.format(
+                tmp_path / 'layers.db'))
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(BaseModel.metadata.create_all)
+                for idx, layer in enumerate(layers):
+                    store = (sqla_yaml_fixtures.Store.from_file(path)
+                             if idx else None)
+                    async with engine.begin() as conn:
+                        store = await sqla_yaml_fixtures.load_core(
+                            BaseModel.metadata, conn, layer, store=store)
+                    store.save(path)
+                async with engine.connect() as conn:
+                    result = await conn.execute(Role.__table__.select())
+                    return result.fetchall()
+            finally:
+                await engine.dispose()
+        roles = asyncio.run(_load())
+        assert [(role.name, role.user_id) for role in roles] == [
+            ('singer', 1), ('bass', 1)]
+        with open(path) as fp:
+            assert set(json.load(fp)) == {'joey', 'r1', 'r2'}
+
+
+class Document(BaseModel):
+    __tablename__ = 'document'
+    id = Column(Integer, primary_key=True)
+    title = Column(String(150))
+    body = Column(Text)
+    data = Column(LargeBinary)
+
+
+class TestFileTag:
+    fixture = """
+- {}:
+  - title: readme
+    body: !file docs/readme.txt
+    data: !file docs/logo.bin
+"""
+
+    @pytest.fixture
+    def docs(self, tmp_path):
+        (tmp_path / 'docs').mkdir()
+        (tmp_path / 'docs' / 'readme.txt').write_text('Hey ho!')
+        (tmp_path / 'docs' / 'logo.bin').write_bytes(b'\x00\xff' * 10)
+        return str(tmp_path / 'fixture.yaml')
+
+    def test_parse(self):
+        fixture = self.fixture.replace('{}', 'Document')
+        data = sqla_yaml_fixtures.parse([('a/b.yaml', fixture)]).sources
+        fields = data[0][1][0]['Document'][0]
+        assert fields['body'] == sqla_yaml_fixtures.FileRef(
+            'a/docs/readme.txt')
+
+    def test_orm(self, session, docs):
+        fixture = self.fixture.replace('{}', 'Document')
+        sqla_yaml_fixtures.load(BaseModel, session, [(docs, fixture)])
+        doc = session.query(Document).one()
+        assert doc.body == 'Hey ho!'
+        assert doc.data == b'\x00\xff' * 10
+
+    @sqlite_returning
+    def test_core_mmap(self, docs, monkeypatch):
+        monkeypatch.setattr(sqla_yaml_fixtures.files, 'MMAP_SIZE', 4)
+        fixture = self.fixture.replace('{}', 'document')
+        _, rows = load_core([(docs, fixture)])
+        assert rows['document'][0].body == 'Hey ho!'
+        assert rows['document'][0].data == b'\x00\xff' * 10
+
+    def test_validate(self, docs):
+        fixture = self.fixture.replace('{}', 'Document')
+        assert sqla_yaml_fixtures.validate(BaseModel, [(docs, fixture)]) == []
+        errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+        assert [e.message for e in errors] == [
+            'File not found: docs/readme.txt', 'File not found: docs/logo.bin']
+
+
+class TestDefaults:
+    users = """
+- User:
+  - __key__: joey
+    username: joey
+  - __key__: dee
+    username: deedee
+"""
+
+    def test_orm(self, session):
+        fixture = self.users + """
+- Role:
+  - __defaults__:
+      name: member
+      user: joey
+  - {}
+  - name: bass
+    user: dee
+"""
+        defaults = sqla_yaml_fixtures.parse(fixture).sources[0][1][1]
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        roles = session.query(Role).order_by(Role.id).all()
+        assert [(r.name, r.user.username) for r in roles] == [
+            ('member', 'joey'), ('bass', 'deedee')]
+        # parsed data not modified
+        assert defaults['Role'][1] == {}
+
+    def test_batch_creator(self, session):
+        Account.batches.clear()
+        fixture = """
+- Account:
+  - __defaults__: {password: ramones}
+  - login: joey
+  - login: dee
+    password: hey
+"""
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        accounts = session.query(Account).order_by(Account.id).all()
+        assert [a.password for a in accounts] == ['$salt$ramones', '$salt$hey']
+
+    @sqlite_returning
+    def test_core(self):
+        fixture = """
+- user:
+  - __key__: joey
+    username: joey
+- role:
+  - __defaults__: {name: member, user_id: joey}
+  - {}
+  - name: singer
+"""
+        _, rows = load_core(fixture)
+        assert [(r.name, r.user_id) for r in rows['role']] == [
+            ('member', 1), ('singer', 1)]
+
+    def test_core_invalid(self):
+        fixture = """
+- role:
+  - __defaults__: {colour: blue}
+"""
+        with pytest.raises(Exception) as exc_info:
+            load_core(fixture)
+        assert 'Inavlid column name: role.colour' in str(exc_info)
+
+    def test_validate(self):
+        fixture = self.users + """
+- Role:
+  - __defaults__: {user: johnny, __key__: x}
+  - name: singer
+  - __defaults__: {name: member}
+"""
+        errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+        assert [(e.path, e.message) for e in errors] == [
+            ('Role.__defaults__', '`__key__` is not allowed.'),
+            ('Role.__defaults__.user', 'Reference to undefined key `johnny`'),
+            ('Role.__defaults__', 'must be the only field of the first item.'),
+        ]
+
+
+class Comment(BaseModel):
+    __tablename__ = 'comment'
+    id = Column(Integer, primary_key=True)
+    text = Column(String(150))
+    parent_id = Column(ForeignKey('comment.id'))
+    quote_id = Column(ForeignKey('comment.id'))
+    parent = relationship('Comment', remote_side=[id],
+                          foreign_keys=[parent_id], back_populates='replies')
+    replies = relationship('Comment', foreign_keys=[parent_id],
+                           back_populates='parent')
+    # nested without back_populates is created before container
+    quote = relationship('Comment', remote_side=[id], foreign_keys=[quote_id])
+
+
+class TestDeepNesting:
+    def test_deeper_than_recursion_limit(self, session):
+        import sys
+        depth = sys.getrecursionlimit() + 100
+        root = leaf = {'text': '0'}
+        for idx in range(1, depth):
+            reply = {'text': str(idx)}
+            leaf['replies'] = [reply]
+            leaf = reply
+        data = [{'Comment': [dict(root, __key__='root')]}]
+        fixtures = sqla_yaml_fixtures.Fixtures([(None, data)])
+        assert sqla_yaml_fixtures.validate(BaseModel, fixtures) == []
+        store = sqla_yaml_fixtures.load(BaseModel, session, fixtures)
+        comment = store.get('root')
+        for idx in range(depth - 1):
+            comment = comment.replies[0]
+        assert comment.text == str(depth - 1)
+        assert comment.parent.text == str(depth - 2)
+
+    def test_order(self, session):
+        fixture = """
+- Comment:
+  - text: a
+    quote: {text: b, quote: {text: c}}
+    replies:
+      - text: d
+"""
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        comment = session.query(Comment).filter_by(text='a').one()
+        assert comment.quote.quote.text == 'c'
+        assert comment.replies[0].text == 'd'
+
+    def test_error_path(self, session):
+        fixture = """
+- Comment:
+  - text: a
+    replies:
+      - text: b
+      - text: c
+        quote: {text: d, colour: blue}
+"""
+        with pytest.raises(Exception) as exc_info:
+            sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        assert ('Error processing Comment.replies[1].quote='
+                in str(exc_info.value))
+        assert 'colour' in str(exc_info.value)
+
+
+class Status(enum.Enum):
+    DRAFT = 'd'
+    PUBLISHED = 'p'
+
+
+class EventTime(sqlalchemy.types.TypeDecorator):
+    impl = DateTime
+    cache_ok = True
+
+
+class Venue(BaseModel):
+    __tablename__ = 'venue'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(150))
+    opened = Column(Date)
+
+
+class Event(BaseModel):
+    __tablename__ = 'event'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(150))
+    day = Column(Date)
+    starts = Column(DateTime)
+    price = Column(Numeric(10, 2))
+    status = Column(Enum(Status))
+    kind = Column(Enum('gig', 'tour', name='event_kind'))
+    details = Column(JSON)
+    ends = Column(EventTime)
+    venue_id = Column(ForeignKey('venue.id'))
+    venue = relationship('Venue')
+
+
+class TestCoercion:
+    fixture = """
+- {}:
+  - __defaults__: {{price: '9.90', status: DRAFT}}
+  - name: a
+    day: '2024-02-29'
+    starts: '2024-02-29T20:30:00'
+    ends: '2024-02-29T23:00:00'
+    kind: gig
+  - name: b
+    day: 2024-03-01
+    starts: 2024-03-01
+    price: 10
+    status: p
+"""
+
+    def test_orm(self, session):
+        fixture = self.fixture.format('Event')
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        a, b = session.query(Event).order_by(Event.id)
+        assert a.day == datetime.date(2024, 2, 29)
+        assert a.starts == datetime.datetime(2024, 2, 29, 20, 30)
+        assert a.ends == datetime.datetime(2024, 2, 29, 23, 0)
+        assert a.price == decimal.Decimal('9.90')
+        assert a.status is Status.DRAFT
+        assert b.starts == datetime.datetime(2024, 3, 1)
+        assert b.price == decimal.Decimal('10')
+        assert b.status is Status.PUBLISHED
+
+    @sqlite_returning
+    def test_core(self):
+        _, rows = load_core(self.fixture.format('event'))
+        assert rows['event'][0].day == datetime.date(2024, 2, 29)
+        assert rows['event'][0].ends == datetime.datetime(2024, 2, 29, 23, 0)
+        assert rows['event'][1].status is Status.PUBLISHED
+
+    def test_errors(self, session):
+        fixture = """
+- Event:
+  - __defaults__: {kind: gig}
+  - day: '2024-02-30'
+  - day: '2024-13-01'
+    kind: party
+  - day: '2024-13-01'
+    status: deleted
+"""
+        with pytest.raises(ValueError) as exc_info:
+            sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        msg = str(exc_info.value)
+        assert ("Invalid value for Event.day (rows 1): day is out of"
+                " range for month") in msg
+        assert 'Invalid value for Event.day (rows 2, 3)' in msg
+        assert "Event.kind (rows 2): 'party' is not one of: gig, tour" in msg
+        assert "Event.status (rows 3): 'deleted' is not a member" in msg
+
+    def test_validate(self):
+        fixture = """
+- Event:
+  - price: ten
+"""
+        errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+        assert [(e.path, e.message) for e in errors] == [
+            ('Event[0].price', "invalid decimal: 'ten'")]
+
+    nested_fixture = """
+- Event:
+  - name: a
+    day: '2020-01-02'
+    venue: {name: v, opened: '%s'}
+"""
+
+    def test_nested(self, session):
+        fixture = self.nested_fixture % '2020-01-03'
+        sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        event = session.query(Event).one()
+        assert event.day == datetime.date(2020, 1, 2)
+        assert event.venue.opened == datetime.date(2020, 1, 3)
+        assert sqla_yaml_fixtures.validate(BaseModel, fixture) == []
+
+    def test_nested_errors(self, session):
+        fixture = self.nested_fixture % '2020-13-01'
+        with pytest.raises(ValueError) as exc_info:
+            sqla_yaml_fixtures.load(BaseModel, session, fixture)
+        assert 'Invalid value for Event[0].venue.opened: ' in str(
+            exc_info.value)
+        errors = sqla_yaml_fixtures.validate(BaseModel, fixture)
+        assert [e.path for e in errors] == ['Event[0].venue.opened']
+
+
+class AuditLog(BaseModel):
+    __tablename__ = 'audit_log'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'))
+    action = Column(String(50))
+
+
+class TestPartition:
+    fixture = '''
+- User:
+  - __key__: joey
+    username: joey
+- AuditLog:
+  - __defaults__: {user_id: 1}
+''' + ''.join('  - action: a{}\n'.format(n) for n in range(9)) + '''
+  - __key__: last
+    action: a9
+'''
+
+    # core: FK columns are references to keys
+    core_fixture = fixture.replace('User', 'user').replace(
+        'AuditLog', 'audit_log').replace('user_id: 1', 'user_id: joey')
+
+    @pytest.fixture(autouse=True)
+    def min_rows(self, monkeypatch):
+        monkeypatch.setattr(
+            sqla_yaml_fixtures.partition, 'PARTITION_MIN_ROWS', 4)
+
+    def test_partitionable(self):
+        sources = sqla_yaml_fixtures.parse('''
+- User:
+  - __key__: joey
+    username: joey
+- Group:
+  - name: g
+    members: [joey.profile]
+''').sources
+        referenced = sqla_yaml_fixtures.partition.referenced_keys(sources)
+        assert referenced == {'joey', 'g'}
+        rows = [{'name': str(n)} for n in range(4)]
+        partitionable = sqla_yaml_fixtures.partition.partitionable
+        assert partitionable(rows, referenced, 2)
+        assert not partitionable(rows, referenced, 1)
+        assert not partitionable(rows[:3], referenced, 2)
+        assert not partitionable(rows + [{'__key__': 'joey'}], referenced, 2)
+        assert partitionable(rows, referenced, 2, {'name'})
+        # i.e. relationships or __init__ params
+        assert not partitionable(rows, referenced, 2, {'id'})
+
+    @pytest.fixture
+    def orm_shards(self, monkeypatch):
+        calls = []
+        create_shard = sqla_yaml_fixtures._create_shard
+        def spy(*args):
+            calls.append(len(args[6]))
+            return create_shard(*args)
+        monkeypatch.setattr(sqla_yaml_fixtures, '_create_shard', spy)
+        return calls
+
+    @pytest.fixture
+    def core_shards(self, monkeypatch):
+        calls = []
+        insert_partitioned = sqla_yaml_fixtures._insert_partitioned
+        def spy(*args):
+            calls.append(len(args[8]))
+            return insert_partitioned(*args)
+        monkeypatch.setattr(sqla_yaml_fixtures, '_insert_partitioned', spy)
+        return calls
+
+    def test_orm(self, tmp_path, orm_shards):
+        engine = create_engine('sqlite:///{}'.format(tmp_path / 'p.db'))
+        BaseModel.metadata.create_all(engine)
+        with Session(bind=engine) as session:
+            store = sqla_yaml_fixtures.load(
+                BaseModel, session, self.fixture, partition=3, stats=True)
+            assert orm_shards == [4, 4, 2]
+            assert store.get('last').action == 'a9'
+            logs = session.query(AuditLog).all()
+            assert sorted(log.action for log in logs) == [
+                'a{}'.format(n) for n in range(10)]
+            assert {log.user_id for log in logs} == {1}
+        # statements of shards are counted
+        assert store.stats.by_mapper['AuditLog']['INSERT'] >= 3
+        engine.dispose()
+
+    def test_orm_not_owned_transaction(self, tmp_path, orm_shards):
+        engine = create_engine('sqlite:///{}'.format(tmp_path / 'p.db'))
+        BaseModel.metadata.create_all(engine)
+        with engine.connect() as conn:
+            with Session(bind=conn) as session:
+                sqla_yaml_fixtures.load(
+                    BaseModel, session, self.fixture, partition=3)
+        with Session(bind=engine) as session:
+            session.add(User(username='dee'))
+            sqla_yaml_fixtures.load(
+                BaseModel, session, self.fixture.replace('joey', 'johnny'),
+                partition=3)
+            assert session.query(AuditLog).count() == 20
+        assert orm_shards == []
+        engine.dispose()
+
+    def test_orm_init_params(self, tmp_path, orm_shards):
+        # `__init__` params might reference keys, not partitioned
+        fixture = '- User:\n' + ''.join(
+            '  - {{__key__: u{0}, username: u{0}}}\n'.format(n)
+            for n in range(4)) + '- Profile:\n' + ''.join(
+            '  - {{the_user: {{ref: u{0}}}, name: p{0}}}\n'.format(n)
+            for n in range(4))
+        engine = create_engine('sqlite:///{}'.format(tmp_path / 'p.db'))
+        BaseModel.metadata.create_all(engine)
+        with Session(bind=engine) as session:
+            sqla_yaml_fixtures.load(BaseModel, session, fixture, partition=2)
+            profiles = session.query(Profile).order_by(Profile.name).all()
+            assert [p.user.username for p in profiles] == [
+                'u0', 'u1', 'u2', 'u3']
+        assert orm_shards == []
+        engine.dispose()
+
+    def test_orm_max_statements(self, tmp_path):
+        engine = create_engine('sqlite:///{}'.format(tmp_path / 'p.db'))
+        BaseModel.metadata.create_all(engine)
+        with Session(bind=engine) as session:
+            with pytest.raises(sqla_yaml_fixtures.StatementBudgetExceeded):
+                sqla_yaml_fixtures.load(BaseModel, session, self.fixture,
+                                        partition=3, max_statements=2)
+        engine.dispose()
+
+    def _load_core(self, path, begin=False, **kwargs):
+        '''@return (store, rows of audit_log)'''
+        async def _load():
+            engine = create_async_engine('sqlite+aiosqlite:///{}'.format(path))
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(BaseModel.metadata.create_all)
+                async with engine.connect() as conn:
+                    if begin:
+                        await conn.begin()
+                    store = await sqla_yaml_fixtures.load_core(
+                        BaseModel.metadata, conn, self.core_fixture,
+                        partition=2, **kwargs)
+                    await conn.commit()
+                async with engine.connect() as conn:
+                    result = await conn.execute(AuditLog.__table__.select())
+                    rows = result.fetchall()
+            finally:
+                await engine.dispose()
+            return store, rows
+        return asyncio.run(_load())
+
+    @sqlite_returning
+    def test_core(self, tmp_path, core_shards):
+        store, rows = self._load_core(tmp_path / 'p.db', stats=True)
+        assert core_shards == [10]
+        assert store.get('last').action == 'a9'
+        assert len(rows) == 10
+        assert {row.user_id for row in rows} == {store.get('joey').id}
+        # statements of shards are counted
+        assert store.stats.by_mapper['audit_log']['INSERT'] == 10
+
+    @sqlite_returning
+    def test_core_not_owned_transaction(self, tmp_path, core_shards):
+        store, rows = self._load_core(tmp_path / 'p.db', begin=True)
+        assert core_shards == []
+        assert len(rows) == 10
+
+    @sqlite_returning
+    def test_core_max_statements(self, tmp_path):
+        with pytest.raises(sqla_yaml_fixtures.StatementBudgetExceeded):
+            self._load_core(tmp_path / 'p.db', max_statements=5)
+
+    @sqlite_returning
+    def test_memory_db(self):
+        # in-memory DB is not shared, loaded on a single connection
+        store, rows = load_core(self.core_fixture, partition=2)
+        assert len(rows['audit_log']) == 10
+        assert store.get('last').action == 'a9'
+
+
+def render_name(text):
+    return text.replace('NAME', 'joey')
+
+
+class TestInclude:
+    @pytest.fixture
+    def files(self, tmp_path):
+        (tmp_path / 'base').mkdir()
+        (tmp_path / 'base' / 'users.yaml').write_text('''
+- User:
+  - __key__: joey
+    username: joey
+''')
+        (tmp_path / 'profiles.yaml').write_text('''
+- __include__: base/users.yaml
+- Profile:
+  - user: joey
+    name: Jeffrey
+''')
+        (tmp_path / 'roles.yaml').write_text('''
+- __include__: [base/users.yaml]
+- Role:
+  - user: joey
+    name: singer
+''')
+        return tmp_path
+
+    @staticmethod
+    def sources(*paths):
+        return [(str(path), path.read_text()) for path in paths]
+
+    def test_load(self, session, files):
+        sources = self.sources(files / 'profiles.yaml', files / 'roles.yaml')
+        fixtures = sqla_yaml_fixtures.parse(sources)
+        users = str(files / 'base' / 'users.yaml')
+        assert [name for name, _ in fixtures.sources] == [
+            users, str(files / 'profiles.yaml'), str(files / 'roles.yaml')]
+        assert fixtures.includes == {
+            str(files / 'profiles.yaml'): [users],
+            str(files / 'roles.yaml'): [users],
+        }
+        store = sqla_yaml_fixtures.load(BaseModel, session, fixtures)
+        joey = store.get('joey')
+        assert joey.profile.name == 'Jeffrey'
+        assert [role.name for role in joey.roles] == ['singer']
+
+    def test_included_source(self, files):
+        # a source already included is not loaded again
+        sources = self.sources(files / 'profiles.yaml',
+                               files / 'base' / 'users.yaml')
+        fixtures = sqla_yaml_fixtures.parse(sources)
+        assert len(fixtures.sources) == 2
+
+    def test_cache(self, files):
+        cache = sqla_yaml_fixtures.IncludeCache()
+        users = files / 'base' / 'users.yaml'
+        loader = sqla_yaml_fixtures.FixtureLoader
+        data = cache.parse(str(users), loader)
+        assert cache.parse(str(users), loader) is data
+        # modified time, same content
+        users.write_text(users.read_text())
+        os.utime(users, ns=(0, 0))
+        assert cache.parse(str(users), loader) is data
+        # saved for other runs
+        cache.save(str(files / 'cache'))
+        cache = sqla_yaml_fixtures.IncludeCache.from_file(
+            str(files / 'cache'))
+        assert cache.parse(str(users), loader) == data
+        users.write_text('- User: []')
+        assert cache.parse(str(users), loader) == [{'User': []}]
+
+    def test_cache_file_not_safe(self, files):
+        # pickle that would run a command on load
+        class Exploit:
+            def __reduce__(self):
+                return (os.system, ('touch {}'.format(files / 'pwned'),))
+        import pickle
+        (files / 'cache').write_bytes(pickle.dumps(Exploit()))
+        cache = sqla_yaml_fixtures.IncludeCache.from_file(
+            str(files / 'cache'))
+        assert cache.entries == {}
+        assert not (files / 'pwned').exists()
+        (files / 'cache').write_bytes(b'not a cache')
+        cache = sqla_yaml_fixtures.IncludeCache.from_file(
+            str(files / 'cache'))
+        assert cache.entries == {}
+
+    def test_render(self, files):
+        (files / 'base' / 'users.yaml').write_text('''
+- User:
+  - __key__: joey
+    username: NAME
+''')
+        sources = self.sources(files / 'profiles.yaml')
+        cache = sqla_yaml_fixtures.IncludeCache()
+        fixtures = sqla_yaml_fixtures.parse(sources, include_cache=cache,
+                                            render=render_name)
+        assert fixtures.sources[0][1] == [
+            {'User': [{'__key__': 'joey', 'username': 'joey'}]}]
+        # rendered and not rendered are cached as different entries
+        fixtures = sqla_yaml_fixtures.parse(sources, include_cache=cache)
+        assert fixtures.sources[0][1] == [
+            {'User': [{'__key__': 'joey', 'username': 'NAME'}]}]
+        assert len(cache.entries) == 2
+
+    def test_validate(self, files):
+        (files / 'loop.yaml').write_text('- __include__: loop2.yaml')
+        (files / 'loop2.yaml').write_text('- __include__: loop.yaml')
+        (files / 'missing.yaml').write_text('- __include__: nope.yaml')
+        sources = self.sources(files / 'loop.yaml', files / 'missing.yaml')
+        errors = sqla_yaml_fixtures.validate(BaseModel, sources, workers=1)
+        assert [(e.source, e.path) for e in errors] == [
+            (str(files / 'loop2.yaml'), '[0].__include__'),
+            (str(files / 'missing.yaml'), '[0].__include__'),
+        ]
+        assert errors[0].message == 'include cycle: {}'.format(
+            files / 'loop.yaml')
+        assert errors[1].message.startswith('can not include')